@@ -0,0 +1,51 @@
+import pandas as pd
+
+# finest grain of the aggregate cube, every chart on the Advanced Analysis page is a roll-up of it
+CUBE_KEYS = ['Country', 'Property_type', 'Room_type']
+# listings with at least this many reviews count towards the preferred property types
+PREFERRED_MIN_REVIEWS = 100
+
+
+def build_airbnb_cube(processed_airbnb_df):
+
+    # a single scan of the listings, sums and counts so that means can be rolled up exactly
+    reviewed = processed_airbnb_df['Number_of_reviews'] >= PREFERRED_MIN_REVIEWS
+    measures = pd.DataFrame({key: processed_airbnb_df[key] for key in CUBE_KEYS})
+    measures['Price'] = processed_airbnb_df['Price'].astype(float)
+    measures['Availability_365'] = processed_airbnb_df['Availability_365'].astype(float)
+    measures['Reviewed_scores'] = processed_airbnb_df['Review_scores'].astype(float).where(reviewed)
+
+    cube = measures.groupby(CUBE_KEYS, observed=True).agg(count=('Price', 'size'),
+                                                           price_count=('Price', 'count'),
+                                                           price_sum=('Price', 'sum'),
+                                                           availability_count=('Availability_365', 'count'),
+                                                           availability_sum=('Availability_365', 'sum'),
+                                                           reviewed_count=('Reviewed_scores', 'count'),
+                                                           reviewed_score_sum=('Reviewed_scores', 'sum'))
+    return cube.reset_index()
+
+
+def roll_up_mean(cube, keys, sum_column, count_column, name):
+
+    rolled = cube.groupby(keys, observed=True)[[sum_column, count_column]].sum()
+    rolled = rolled[rolled[count_column] > 0]
+    return (rolled[sum_column] / rolled[count_column]).rename(name).reset_index()
+
+
+def filter_processed_airbnb_df(processed_airbnb_df, cube=None):
+
+    if cube is None:
+        cube = build_airbnb_cube(processed_airbnb_df)
+
+    country_mean_price = roll_up_mean(cube, ['Country'], 'price_sum', 'price_count', 'Price')
+    property_mean_price = roll_up_mean(cube, ['Country', 'Property_type'], 'price_sum', 'price_count', 'Price')
+    country_availability_mean = roll_up_mean(cube, ['Country', 'Property_type'], 'availability_sum', 'availability_count', 'Availability_365')
+    room_type_property_mean_price = roll_up_mean(cube, CUBE_KEYS, 'price_sum', 'price_count', 'Price')
+    hotel_count_by_property = cube.groupby(['Country', 'Property_type'], observed=True)['count'].sum().reset_index(name='count')
+
+    #most preferred by property type
+    preferred_property_country = roll_up_mean(cube, ['Country', 'Property_type'], 'reviewed_score_sum', 'reviewed_count', 'Review_scores')
+    idx = preferred_property_country.groupby('Country', observed=True)['Review_scores'].idxmax()
+    preferred_property_country = preferred_property_country.loc[idx]
+
+    return country_mean_price, property_mean_price, country_availability_mean, room_type_property_mean_price, hotel_count_by_property, preferred_property_country
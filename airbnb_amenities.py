@@ -0,0 +1,121 @@
+from collections import namedtuple
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+# separator used by airbnb_columns_to_dataframe when joining the amenities array of a listing
+AMENITY_SEPARATOR = ', '
+# amenities with fewer listings than this (with or without them) are left out of the lift table, their means are noise
+AMENITY_LIFT_MIN_LISTINGS = 30
+
+# vocabulary: interned amenity names, sorted, position = amenity code
+# indptr, codes: listing x amenity matrix in CSR form, the amenities of row i are codes[indptr[i]:indptr[i + 1]]
+# bitmaps: inverted index, one packed bit per listing for every amenity, row = amenity code
+AmenityIndex = namedtuple('AmenityIndex', ['vocabulary', 'indptr', 'codes', 'bitmaps', 'counts', 'rows', 'nbytes'])
+
+
+def split_amenities(amenities):
+
+    # '' from extraction and 'NA' after preprocessing both mean no amenities
+    return amenities.split(AMENITY_SEPARATOR) if amenities and amenities != 'NA' else []
+
+
+def build_amenity_index(processed_airbnb_df):
+
+    # the joined strings are parsed once per dataset version, queries never touch them again
+    tokens = [split_amenities(amenities) for amenities in processed_airbnb_df['Amenities'].to_numpy(dtype=object)]
+    rows = len(tokens)
+    row_ids = np.repeat(np.arange(rows, dtype=np.int64), np.fromiter(map(len, tokens), dtype=np.int64, count=rows))
+    codes, vocabulary = pd.factorize(pd.Series(list(chain.from_iterable(tokens)), dtype=object), sort=True)
+    vocabulary = pd.Index(vocabulary, dtype=object)
+
+    # one entry per (listing, amenity), an amenity listed twice counts once; sorted by listing then amenity
+    keys = np.unique(row_ids * max(len(vocabulary), 1) + codes)
+    row_ids, codes = np.divmod(keys, max(len(vocabulary), 1))
+    indptr = np.zeros(rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_ids, minlength=rows), out=indptr[1:])
+    codes = codes.astype(np.uint16 if len(vocabulary) <= np.iinfo(np.uint16).max else np.uint32)
+
+    # postings grouped by amenity and written as bitmaps, multi amenity queries are a bitwise and of a few rows
+    counts = np.bincount(codes, minlength=len(vocabulary))
+    postings = row_ids[np.argsort(codes, kind='stable')]
+    bitmaps = np.zeros((len(vocabulary), (rows + 7) // 8), dtype=np.uint8)
+    members = np.zeros(rows, dtype=bool)
+    start = 0
+    for code, count in enumerate(counts):
+        members[:] = False
+        members[postings[start:start + count]] = True
+        bitmaps[code] = np.packbits(members)
+        start += count
+
+    nbytes = indptr.nbytes + codes.nbytes + bitmaps.nbytes + counts.nbytes + sum(len(name) for name in vocabulary)
+    return AmenityIndex(vocabulary, indptr, codes, bitmaps, counts, rows, nbytes)
+
+
+def amenity_bitmap(amenity_index, amenities):
+
+    # packed bits of the listings having every one of the amenities, None when nothing is required
+    if not amenities:
+        return None
+    codes = amenity_index.vocabulary.get_indexer(list(amenities))
+    if (codes < 0).any():
+        return np.zeros(amenity_index.bitmaps.shape[1], dtype=np.uint8)
+    return np.bitwise_and.reduce(amenity_index.bitmaps[codes], axis=0)
+
+
+def has_amenities(amenity_index, positions, amenities):
+
+    # for every row position, whether that listing has all the amenities; positions outside the data (-1) never match
+    positions = np.asarray(positions, dtype=np.int64)
+    bitmap = amenity_bitmap(amenity_index, amenities)
+    if bitmap is None:
+        return positions >= 0
+    valid = positions >= 0
+    found = np.zeros(len(positions), dtype=bool)
+    found[valid] = (bitmap[positions[valid] >> 3] & (128 >> (positions[valid] & 7))) != 0
+    return found
+
+
+def amenity_positions(amenity_index, amenities):
+
+    bitmap = amenity_bitmap(amenity_index, amenities)
+    if bitmap is None:
+        return np.arange(amenity_index.rows)
+    return np.flatnonzero(np.unpackbits(bitmap, count=amenity_index.rows))
+
+
+def amenity_price_lift(amenity_index, processed_airbnb_df, min_listings=AMENITY_LIFT_MIN_LISTINGS):
+
+    # mean price of the listings with an amenity against those without it, for all listings and within every country
+    prices = processed_airbnb_df['Price'].to_numpy(dtype=np.float64)
+    countries = processed_airbnb_df['Country'].astype('category')
+    country_codes = countries.cat.codes.to_numpy(dtype=np.int64)
+    vocabulary_size = len(amenity_index.vocabulary)
+    row_ids = np.repeat(np.arange(amenity_index.rows, dtype=np.int64), np.diff(amenity_index.indptr))
+    codes = amenity_index.codes.astype(np.int64)
+
+    groups = [('All', slice(None), codes, row_ids)]
+    # entries are sorted by listing, selecting the entries of one country keeps them aligned with their rows
+    entry_countries = country_codes[row_ids]
+    for country_code, country in enumerate(countries.cat.categories):
+        in_country = entry_countries == country_code
+        groups.append((country, country_codes == country_code, codes[in_country], row_ids[in_country]))
+
+    tables = []
+    for country, rows, group_codes, group_rows in groups:
+        listings = np.bincount(group_codes, minlength=vocabulary_size)
+        price_sum = np.bincount(group_codes, weights=prices[group_rows], minlength=vocabulary_size)
+        total, total_sum = len(prices[rows]), prices[rows].sum()
+        without = total - listings
+        keep = (listings >= min_listings) & (without >= min_listings)
+        with_price = price_sum[keep] / listings[keep]
+        without_price = (total_sum - price_sum[keep]) / without[keep]
+        tables.append(pd.DataFrame({'Country': country,
+                                    'Amenity': amenity_index.vocabulary[keep],
+                                    'Listings': listings[keep],
+                                    'Share': listings[keep] / total,
+                                    'Price_with': with_price,
+                                    'Price_without': without_price,
+                                    'Lift': with_price / without_price}))
+    return pd.concat(tables, ignore_index=True)
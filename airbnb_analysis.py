@@ -1,72 +1,89 @@
-from pymongo import MongoClient
 import streamlit as st
 import pandas as pd
+import numpy as np
 from streamlit_option_menu import option_menu
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-import folium
-from streamlit_folium import st_folium
-from folium.plugins import MarkerCluster
+from airbnb_extraction import AIRBNB_CHUNK_SIZE, extract_airbnb_data, extract_airbnb_data_parallel, iter_airbnb_chunks
+from airbnb_preprocessing import convert_airbnb_dtypes, fill_missing_airbnb_data, split_airbnb_columns, concat_airbnb_columns, airbnb_memory_usage
+from airbnb_snapshot import read_snapshot_manifest, refresh_snapshot, invalidate_snapshot
+from airbnb_cache import (SharedAirbnbData, get_airbnb_collection, get_shared_airbnb_data, put_shared_airbnb_data, evict_shared_airbnb_data,
+                          is_shared_airbnb_data, get_derived_airbnb_data, load_snapshot_airbnb_data, new_dataset_version)
+from airbnb_instrumentation import begin_rerun, perf_span, memory_tracing_requested, start_memory_tracing
+# plotting, mapping and pymongo imports are done by the page that needs them, a cold worker only pays for the page being shown
 
-def preprocess_airbnb_data(airbnb_data):
+def preprocess_airbnb_data(airbnb_data, already_converted=False):
 
     try:
-        # converting to required datatype
-        airbnb_data['Maximum_nights'] = airbnb_data['Maximum_nights'].astype(int)
-        airbnb_data['Minimum_nights'] = airbnb_data['Minimum_nights'].astype(int)
-        airbnb_data['Security_deposit'] = airbnb_data['Security_deposit'].astype(str)
-        airbnb_data['Security_deposit'] = pd.to_numeric(airbnb_data['Security_deposit'], errors="coerce")
-        airbnb_data['Price'] = airbnb_data['Price'].astype(str)
-        airbnb_data['Price'] = airbnb_data['Price'].astype(float)
-        airbnb_data['Cleaning_fee'] = airbnb_data['Cleaning_fee'].astype(str)
-        airbnb_data['Cleaning_fee'] = pd.to_numeric(airbnb_data['Cleaning_fee'], errors="coerce")
-        airbnb_data['Extra_people'] = airbnb_data['Extra_people'].astype(str)
-        airbnb_data['Extra_people'] = airbnb_data['Extra_people'].astype(float)
-        airbnb_data['Extra_people'] = airbnb_data['Extra_people'].astype(int)
-        airbnb_data['Guests_included'] = airbnb_data['Guests_included'].astype(str)
-        airbnb_data['Guests_included'] = airbnb_data['Guests_included'].astype(float)
-        airbnb_data['Guests_included'] = airbnb_data['Guests_included'].astype(int)
-        # updating empty values with relevant data
-        airbnb_data['Total_beds'] = airbnb_data['Total_beds'].fillna(airbnb_data['Total_beds'].value_counts().idxmax())
-        airbnb_data['Total_bedrooms']= airbnb_data['Total_bedrooms'].fillna(airbnb_data['Total_bedrooms'].value_counts().idxmax())
-        airbnb_data['Security_deposit'] = airbnb_data['Security_deposit'].fillna(int(airbnb_data['Security_deposit'].mean()))
-        airbnb_data['Cleaning_fee'] = airbnb_data['Cleaning_fee'].fillna(airbnb_data['Cleaning_fee'].mean())
-        airbnb_data['Review_scores'] = airbnb_data['Review_scores'].fillna(airbnb_data['Review_scores'].value_counts().idxmax())
-
-        airbnb_data['Description'] = airbnb_data['Description'].replace(to_replace='', value='NA')
-        airbnb_data['House_rules'] = airbnb_data['House_rules'].replace(to_replace='', value='NA')
-        airbnb_data['Amenities'] = airbnb_data['Amenities'].replace(to_replace='', value='NA')
-        return airbnb_data
-      
+        # the caller's frame is never modified
+        with perf_span('preprocess: copy' if already_converted else 'preprocess: convert dtypes', len(airbnb_data)):
+            processed_df = airbnb_data.copy() if already_converted else convert_airbnb_dtypes(airbnb_data)
+        with perf_span('preprocess: fill missing', len(processed_df)):
+            return fill_missing_airbnb_data(processed_df)
+
     except Exception as e:
         st.error(f"Error in preprocessing data : {e}")
 
-def filter_processed_airbnb_df(processed_airbnb_df):
-
-
-    country_mean_price = processed_airbnb_df.groupby(processed_airbnb_df["Country"]).agg({'Price': 'mean'}).reset_index()
-    property_mean_price = processed_airbnb_df.groupby([processed_airbnb_df["Country"], processed_airbnb_df["Property_type"]]).agg({'Price': 'mean'}).reset_index()
-    country_availability_mean = processed_airbnb_df.groupby([processed_airbnb_df["Country"], processed_airbnb_df["Property_type"]]).agg({'Availability_365': 'mean'}).reset_index() 
-    room_type_property_mean_price = processed_airbnb_df.groupby([processed_airbnb_df["Country"], processed_airbnb_df["Property_type"], processed_airbnb_df["Room_type"]]).agg({'Price': 'mean'}).reset_index()
-    hotel_count_by_property = processed_airbnb_df.groupby([processed_airbnb_df["Country"], processed_airbnb_df["Property_type"]]).size().reset_index(name='count')
-
-    #most preferred by property type
-    preferred_property_country = processed_airbnb_df[processed_airbnb_df["Number_of_reviews"] >= 100]
-    preferred_property_country = preferred_property_country.groupby([processed_airbnb_df["Country"], processed_airbnb_df["Property_type"]]).agg({"Review_scores": "mean"}).reset_index()
-    idx = preferred_property_country.groupby('Country')['Review_scores'].idxmax()
-    preferred_property_country = preferred_property_country.loc[idx]
-
-    return country_mean_price, property_mean_price, country_availability_mean, room_type_property_mean_price, hotel_count_by_property, preferred_property_country
+def preprocess_shared_airbnb_data(shared_extracted):
+
+    processed_df = preprocess_airbnb_data(shared_extracted.df, shared_extracted.converted)
+    if processed_df is None:
+        return None
+    return SharedAirbnbData(shared_extracted.version, processed_df, True, None)
+
+def extract_shared_airbnb_data(stage, extract):
+
+    with perf_span(stage) as span:
+        extracted_df = extract()
+        span.rows = len(extracted_df)
+    return SharedAirbnbData(new_dataset_version(), extracted_df, False, None)
+
+def session_airbnb_data(name, loader=None):
+
+    # the shared entry when there is one, else the session's own reference: data evicted from the shared cache, or too
+    # large for it, stays with the session that loaded it. The loader only runs when neither has the data
+    entry = get_shared_airbnb_data(name) or st.session_state.get(f'shared_{name}') or get_shared_airbnb_data(name, loader)
+    st.session_state[f'shared_{name}'] = entry
+    return entry
+
+def keep_session_airbnb_data(name, entry, container):
+
+    st.session_state[f'shared_{name}'] = entry
+    if entry is not None and not is_shared_airbnb_data(name, entry):
+        container.warning("The data is larger than the shared cache, it is kept for this session only and other sessions will load it again")
+    return entry
+
+def stream_airbnb_data(collection, chunk_size, container):
+
+    # every chunk is type converted as it arrives, first rows are shown while the rest is loading
+    total_listings = max(collection.estimated_document_count(), 1)
+    progress_bar = container.progress(0.0, text="Fetching data...")
+    preview = container.empty()
+    chunks = []
+    fetched = 0
+    # one span for the whole stream, extraction and conversion of the chunks overlap with drawing the progress
+    with perf_span('extraction (streamed)') as span:
+        for chunk in iter_airbnb_chunks(collection, chunk_size=chunk_size):
+            chunks.append(split_airbnb_columns(convert_airbnb_dtypes(chunk)))
+            fetched += len(chunk)
+            progress_bar.progress(min(fetched / total_listings, 1.0), text=f"Fetched {fetched} listings")
+            if len(chunks) == 1:
+                preview.dataframe(chunk.head(100), use_container_width=True)
+        span.rows = fetched
+    progress_bar.empty()
+    preview.empty()
+    if not chunks:
+        return None
+    # the chunks are released column by column while the frame is assembled, it is not built next to a full second copy
+    return SharedAirbnbData(new_dataset_version(), concat_airbnb_columns(chunks), True, None)
 
 
 if __name__ == "__main__":
 
-    #Initializing the session state
-    if 'airbnb_data' not in st.session_state:
-        st.session_state.airbnb_data = None
-    if 'processed_airbnb_df' not in st.session_state:
-        st.session_state['processed_airbnb_df'] = None
+    #Initializing the session state with references to the data shared by all sessions
+    shared_extracted = session_airbnb_data('extracted')
+    # cold start from the local snapshot when nothing is shared yet
+    shared_processed = session_airbnb_data('processed', load_snapshot_airbnb_data)
+    st.session_state.airbnb_data = shared_extracted.df if shared_extracted is not None else None
+    st.session_state['processed_airbnb_df'] = shared_processed.df if shared_processed is not None else None
 
     # set app page layout type
     st.set_page_config(layout="wide")
@@ -75,8 +92,8 @@ if __name__ == "__main__":
     with st.sidebar:        
         page = option_menu(
                             menu_title='Airbnb Analysis',
-                            options=['Data Preparation','Exploratory Data Analysis (EDA)', 'Geospatial Visualization', 'Advanced Analysis'],
-                            icons=['gear', 'map', 'info-circle', 'bar-chart-line'],
+                            options=['Data Preparation','Exploratory Data Analysis (EDA)', 'Geospatial Visualization', 'Advanced Analysis', 'Performance'],
+                            icons=['gear', 'map', 'info-circle', 'bar-chart-line', 'speedometer2'],
                             menu_icon="pin-map-fill",
                             default_index=0 ,
                             styles={"container": {"padding": "5!important"},
@@ -86,6 +103,12 @@ if __name__ == "__main__":
                                     "nav-link-selected": {"background-color": "grey"},}  
         )
 
+    # every span timed during this script run is recorded under one rerun of this session
+    st.session_state.setdefault('perf_session', new_dataset_version())
+    begin_rerun(st.session_state['perf_session'], page)
+    if memory_tracing_requested():
+        start_memory_tracing()
+
 
 if page == "Data Preparation":
 
@@ -95,59 +118,30 @@ if page == "Data Preparation":
     container_1 = col1.container(border=False, height=550)
     container_2 = col2.container(border=False, height=550)
     airbnb_data_extract = container_1.button("Connect to MongoDB", use_container_width = True)
+    col_stream, col_chunk = container_1.columns([1,1])
+    stream_data = col_stream.toggle("Stream data in chunks")
+    fresh_extraction = col_stream.toggle("Ignore data shared by other sessions")
+    chunk_size = col_chunk.number_input("Chunk size", min_value=500, max_value=100000, value=AIRBNB_CHUNK_SIZE, step=500, disabled=not stream_data)
+    parallel_extraction = col_chunk.toggle("Read with parallel cursors", disabled=stream_data)
     container_1.image("data_image.webp")
     data = []
     if airbnb_data_extract:
-        #Connecting to MongoDB
-        client = MongoClient("mongodb://localhost:27017")
-        #Accessing airbnb data
-        db = client["sample_airbnb"]
-        collection = db["listingsAndReviews"]
-
-        extracted_data = collection.find()
-        airbnb_required_data = []
-        # a = 0
-        for data in extracted_data:
-            dict_data = dict(Id = data['_id'],
-                             Listing_url = data['listing_url'],
-                             Name = data.get('name'),
-                             Description = data['description'],
-                             House_rules = data.get('house_rules'),
-                             Property_type = data['property_type'],
-                             Room_type = data['room_type'],
-                             Bed_type = data['bed_type'],
-                             Minimum_nights = int(data['minimum_nights']),
-                             Maximum_nights = int(data['maximum_nights']),
-                             Cancellation_policy = data['cancellation_policy'],
-                             Accommodates = data['accommodates'],
-                             Total_bedrooms = data.get('bedrooms'),
-                             Total_beds = data.get('beds'),
-                             Number_of_reviews = data['number_of_reviews'],
-                             Amenities = ', '.join(data['amenities']),
-                             Price = data['price'],
-                             Security_deposit = data.get('security_deposit'),
-                             Cleaning_fee = data.get('cleaning_fee'),
-                             Extra_people = data['extra_people'],
-                             Guests_included= data['guests_included'],
-                             Host_id = data['host']['host_id'],
-                             Host_name = data['host']['host_name'],
-                             Street = data['address']['street'],
-                             Country = data['address']['country'],
-                             Country_code = data['address']['country_code'],
-                             Location_type = data['address']['location']['type'],
-                             Longitude = data['address']['location']['coordinates'][0],
-                             Latitude = data['address']['location']['coordinates'][1],
-                             Is_location_exact = data['address']['location']['is_location_exact'],
-                             Availability_365 = data['availability']['availability_365'],
-                             Review_scores = data['review_scores'].get('review_scores_rating')     
-            )
-            airbnb_required_data.append(dict_data)
-            # a += 1
-            # if a == 100:
-            #     break
-
-        st.session_state.airbnb_data = pd.DataFrame(airbnb_required_data)
-        if st.session_state.airbnb_data is not None:
+        if fresh_extraction:
+            evict_shared_airbnb_data('extracted')
+        #Accessing airbnb data through the shared connection pool
+        collection = get_airbnb_collection()
+
+        # extraction runs once, every other session reuses the shared result
+        if stream_data:
+            shared_extracted = get_shared_airbnb_data('extracted', lambda: stream_airbnb_data(collection, int(chunk_size), container_2))
+        elif parallel_extraction:
+            # disjoint _id ranges, one cursor each
+            shared_extracted = get_shared_airbnb_data('extracted', lambda: extract_shared_airbnb_data('extraction (parallel)', lambda: extract_airbnb_data_parallel(collection)))
+        else:
+            shared_extracted = get_shared_airbnb_data('extracted', lambda: extract_shared_airbnb_data('extraction', lambda: extract_airbnb_data(collection)))
+        keep_session_airbnb_data('extracted', shared_extracted, container_2)
+        if shared_extracted is not None:
+            st.session_state.airbnb_data = shared_extracted.df
             container_2.success("The data has been fetched successfully!")
             container_2.dataframe(st.session_state.airbnb_data, use_container_width=True)
         else:
@@ -158,20 +152,55 @@ if page == "Data Preparation":
     preprocess_button = col3.button("Click to preprocess extracted data", use_container_width = True)
     if preprocess_button:
         if airbnb_data is not None:
-                processed_df = preprocess_airbnb_data(airbnb_data)
-                # Storing processed data in session state
-                st.session_state['processed_airbnb_df'] = processed_df
-                if processed_df is not None:
+                if shared_processed is None or shared_processed.version != shared_extracted.version:
+                    evict_shared_airbnb_data('processed')
+                # preprocessing works on a copy, the shared extracted data stays untouched
+                shared_processed = get_shared_airbnb_data('processed', lambda: preprocess_shared_airbnb_data(shared_extracted))
+                keep_session_airbnb_data('processed', shared_processed, container_2)
+                # Storing a reference to the shared processed data in session state
+                st.session_state['processed_airbnb_df'] = shared_processed.df if shared_processed is not None else None
+                if shared_processed is not None:
                     container_2.success("Successfully cleaned and preprocessed data")
+                    container_2.info(f"Memory usage : {airbnb_memory_usage(airbnb_data):.1f} MB extracted, {airbnb_memory_usage(shared_processed.df):.1f} MB preprocessed")
                 container_2.dataframe(st.session_state['processed_airbnb_df'])
         else:
             container_2.warning("Please fetch data first!")
 
+    # local parquet snapshot, refreshed with only the new or changed listings
+    col_refresh, col_invalidate = col4.columns([1,1])
+    refresh_snapshot_button = col_refresh.button("Refresh local snapshot", use_container_width = True)
+    invalidate_snapshot_button = col_invalidate.button("Invalidate local snapshot", use_container_width = True)
+    if refresh_snapshot_button:
+        try:
+            with perf_span('snapshot refresh') as span:
+                processed_df, manifest, changed_rows = refresh_snapshot(get_airbnb_collection())
+                span.rows = changed_rows
+            # replaces the shared processed data for every session
+            shared_processed = put_shared_airbnb_data('processed', SharedAirbnbData(manifest['version'], processed_df, True, manifest))
+            keep_session_airbnb_data('processed', shared_processed, container_2)
+            st.session_state['processed_airbnb_df'] = processed_df
+            container_2.success(f"Snapshot updated with {changed_rows} new or changed listings")
+            container_2.dataframe(processed_df)
+        except Exception as e:
+            container_2.error(f"Error in refreshing snapshot : {e}")
+    if invalidate_snapshot_button:
+        invalidate_snapshot()
+        container_2.warning("Local snapshot removed, next refresh will do a full extraction")
+    manifest = read_snapshot_manifest()
+    if manifest is not None:
+        col4.caption(f"Snapshot version {manifest['version']} : {manifest['rows']} listings, refreshed {manifest['refreshed']}")
+
     col001, col002 = st.columns([10,2])
     col002.write(":orange[Note: All cost is in dollars($)]")
 
 if page == "Exploratory Data Analysis (EDA)":
-    
+
+    import os
+    # airbnb_eda (matplotlib, seaborn) loads with the first figure rendered, pymongo with the first MongoDB statistics
+    from airbnb_cache import render_eda_png, get_versioned_airbnb_data
+    from airbnb_sketches import eda_stats_from_chunks, parquet_chunks, mongo_eda_stats
+    from airbnb_snapshot import SNAPSHOT_DIR, PROCESSED_FILE
+
     col001, col002 = st.columns([10,2])
     col002.write(":orange[Note: All cost is in dollars($)]")
 
@@ -179,6 +208,38 @@ if page == "Exploratory Data Analysis (EDA)":
     
     st.header("Exploratory Data Analysis (EDA) on Preprocessed Airbnb Data", divider = "rainbow")
 
+    # figures are rendered once per dataset version and layout, the statistics behind them once per dataset version;
+    # the streamed sources only hold one chunk of listings at a time, for data that does not fit in memory
+    eda_source = st.radio('Statistics from', ['Loaded data', 'Local snapshot (streamed)', 'MongoDB (streamed)'], horizontal=True)
+    eda_stats = None
+    if eda_source == 'Loaded data':
+        if processed_airbnb_df is not None:
+            eda_stats = get_derived_airbnb_data('eda_stats', shared_processed, lambda df: eda_stats_from_chunks([df]))
+            dataset_version = shared_processed.version
+    elif eda_source == 'Local snapshot (streamed)':
+        manifest = read_snapshot_manifest()
+        if manifest is not None:
+            dataset_version = f"snapshot-{manifest['version']}"
+            with perf_span('eda: statistics streamed from snapshot', manifest['rows']):
+                eda_stats = get_versioned_airbnb_data('eda_stats_snapshot', dataset_version,
+                                                      lambda: eda_stats_from_chunks(parquet_chunks(os.path.join(SNAPSHOT_DIR, PROCESSED_FILE))))
+        else:
+            st.warning("No local snapshot, refresh it from the Data Preparation page first")
+    else:
+        # the collection has no version, statistics are kept until they are computed again
+        if st.button("Compute statistics from MongoDB"):
+            from pymongo.errors import PyMongoError
+            try:
+                with perf_span('eda: statistics streamed from mongodb'):
+                    put_shared_airbnb_data('eda_stats_mongo', SharedAirbnbData(f"mongo-{new_dataset_version()}",
+                                                                               mongo_eda_stats(get_airbnb_collection()), True, None))
+            except PyMongoError as e:
+                st.error(f"Failed to compute statistics from MongoDB: {e}")
+        shared_mongo_stats = get_shared_airbnb_data('eda_stats_mongo')
+        if shared_mongo_stats is not None:
+            eda_stats = shared_mongo_stats.df
+            dataset_version = shared_mongo_stats.version
+
     # Distribution Plots
     with st.expander("1) Distribution Plots"):
         
@@ -186,48 +247,14 @@ if page == "Exploratory Data Analysis (EDA)":
         container_0 = col01.container(border=True)
         st.write("")
         cols_in_grid = container_0.slider(':blue[Number of columns in the grid]', 1, 4, 2)
-        if processed_airbnb_df is not None:
+        if eda_stats is not None:
             # histograms
             st.subheader("Histograms")
-            histo_columns = ['Minimum_nights', 'Maximum_nights', 'Accommodates', 'Total_bedrooms', 'Total_beds', 'Number_of_reviews', 
-                                'Price', 'Security_deposit', 'Cleaning_fee', 'Extra_people', 'Guests_included', 'Availability_365', 'Review_scores']
-            
-            req_columns = len(histo_columns)
-            rows_in_grid = (req_columns + cols_in_grid - 1) // cols_in_grid
-
-            fig, axes = plt.subplots(rows_in_grid, cols_in_grid, figsize=(15, 5 * rows_in_grid))
-            axes = axes.flatten()
-            for i, column in enumerate(histo_columns):
-                sns.histplot(processed_airbnb_df[column], kde=True, bins=20, ax=axes[i])
-                axes[i].set_title(column)
-                axes[i].set_ylabel('Frequency')
-
-            for j in range(req_columns, len(axes)):
-                fig.delaxes(axes[j])
-
-            plt.tight_layout()
-            st.pyplot(fig)
+            st.image(render_eda_png(dataset_version, 'histograms', cols_in_grid, eda_stats), use_column_width=True)
 
             # box plots
             st.subheader("Box Plots")
-            boxplt_columns = ['Minimum_nights', 'Maximum_nights', 'Accommodates', 'Total_bedrooms', 'Total_beds', 'Availability_365', 
-                                'Price', 'Security_deposit', 'Cleaning_fee', 'Extra_people', 'Review_scores']
-            
-            req_columns = len(boxplt_columns)
-            rows_in_grid = (req_columns + cols_in_grid - 1) // cols_in_grid
-
-            fig, axes = plt.subplots(rows_in_grid, cols_in_grid, figsize=(15, 5 * rows_in_grid))
-            axes = axes.flatten()
-            
-            for i, column in enumerate(boxplt_columns):
-                sns.boxplot(data = processed_airbnb_df[column], ax=axes[i])
-                axes[i].set_title(column)
-
-            for j in range(req_columns, len(axes)):
-                fig.delaxes(axes[j])
-
-            plt.tight_layout()
-            st.pyplot(fig)
+            st.image(render_eda_png(dataset_version, 'boxplots', cols_in_grid, eda_stats), use_column_width=True)
 
         else:
             st.warning("Processed Data Not Available!")
@@ -235,70 +262,25 @@ if page == "Exploratory Data Analysis (EDA)":
     # Relationship Plots
     with st.expander("2) Relationship Plots"):
 
-        if processed_airbnb_df is not None:
+        # scatter plots draw listings, they need the loaded data
+        if processed_airbnb_df is not None and eda_source == 'Loaded data':
             # scatter plots
             st.subheader("Scatter Plots")
-            fig, axes = plt.subplots(3, 2, figsize=(15, 15))
-
-            sns.scatterplot(x='Review_scores', y='Price', data=processed_airbnb_df, ax=axes[0, 0])
-            axes[0, 0].set_title('Review Scores Vs Price')
-
-            sns.scatterplot(x='Accommodates', y='Price', data=processed_airbnb_df, ax=axes[0, 1])
-            axes[0, 1].set_title('Accommodates Vs Price')
-
-            sns.scatterplot(x='Availability_365', y='Price', data=processed_airbnb_df, ax=axes[1, 0])
-            axes[1, 0].set_title('Availability_365 Vs Price')
-
-            sns.scatterplot(x='Property_type', y='Price', data=processed_airbnb_df, ax=axes[1, 1])
-            axes[1, 1].set_xticklabels(axes[1, 1].get_xticklabels(), rotation=90)
-            axes[1, 1].set_title('Property Type Vs Price')
-
-            sns.scatterplot(x='Number_of_reviews', y='Price', size='Accommodates', data=processed_airbnb_df, ax=axes[2, 0])
-            axes[2, 0].set_title('Number of Reviews Vs Price')
-
-
-            price_review = sns.scatterplot(x='Price', y='Review_scores', hue='Property_type', data=processed_airbnb_df, ax=axes[2, 1])
-            axes[2, 1].set_title('Price vs. Review Scores (Upon Property Type)')
-            price_review.legend(loc='upper left', bbox_to_anchor=(1, 1))
-            plt.tight_layout()
-            st.pyplot(fig)
+            st.image(render_eda_png(dataset_version, 'scatter', None, processed_airbnb_df), use_column_width=True)
 
+        elif eda_source != 'Loaded data':
+            st.info("Scatter plots draw every listing, they are only shown for the loaded data")
         else:
             st.warning("Processed Data Not Available!")
 
     # Categorical Plots
     with st.expander("3) Categorical Plots"):
 
-        if processed_airbnb_df is not None:
+        if eda_stats is not None:
             
             st.subheader("Count Plots")   
-            fig, ax = plt.subplots(figsize=(12, 3))
-            sorted_property_types = processed_airbnb_df['Country'].value_counts()
-            ax = sns.countplot(data=processed_airbnb_df, x='Country', order=sorted_property_types.index, palette="Paired", ax=ax)
-            ax.set_title("Listing Count For Each Country")
-            st.pyplot(fig)
-
-            fig, ax = plt.subplots(figsize=(12, 5))
-            sorted_property_types = processed_airbnb_df['Property_type'].value_counts()
-            ax = sns.countplot(data=processed_airbnb_df, y='Property_type', order=sorted_property_types.index, palette="Set2", ax=ax)
-            ax.set_title("Listing Count For Each Property Type")
-            st.pyplot(fig)
-
-
-            fig, ax = plt.subplots(figsize=(12, 2))
-            ax = sns.countplot(data=processed_airbnb_df, y='Room_type', palette='Dark2')
-            ax.set_title("Count Of Each Room Type")
-            st.pyplot(fig)
-
-            fig, ax = plt.subplots(figsize=(12, 2))
-            ax = sns.countplot(data=processed_airbnb_df, x='Cancellation_policy', palette='pastel')
-            ax.set_title("Count Of Each Cancellation Policy")
-            st.pyplot(fig)
-
-            fig, ax = plt.subplots(figsize=(12, 3))
-            ax = sns.countplot(data=processed_airbnb_df, x='Bed_type', palette='Accent')
-            ax.set_title("Count Of Each Bed Type")
-            st.pyplot(fig)
+            for column in ['Country', 'Property_type', 'Room_type', 'Cancellation_policy', 'Bed_type']:
+                st.image(render_eda_png(dataset_version, 'count', column, eda_stats), use_column_width=True)
 
         else:
             st.warning("Processed Data Not Available!")
@@ -306,48 +288,138 @@ if page == "Exploratory Data Analysis (EDA)":
     #Heatmap
     with st.expander("4) Heatmap"):
 
-        if processed_airbnb_df is not None:
+        if eda_stats is not None:
             st.subheader("Heatmap")
-            heatmp_columns = ['Minimum_nights', 'Maximum_nights', 'Accommodates', 'Total_bedrooms', 'Total_beds', 'Availability_365', 'Number_of_reviews',
-                                'Price', 'Security_deposit', 'Cleaning_fee', 'Extra_people', 'Guests_included',  'Review_scores']
-            req_columns = processed_airbnb_df[heatmp_columns]
-            fig, ax = plt.subplots(figsize=(12, 8))
-            sns.heatmap(req_columns.corr(), annot=True, cmap='viridis', vmin=-1, vmax=1, ax=ax)
-            plt.title('Correlation Heatmap')
-            st.pyplot(plt)
+            st.image(render_eda_png(dataset_version, 'heatmap', None, eda_stats), use_column_width=True)
 
         else:
             st.warning("Processed Data Not Available!")
 
 if page == "Geospatial Visualization":
 
+    from pymongo.errors import PyMongoError, ConnectionFailure
+    import plotly.express as px
+    from streamlit_folium import st_folium
+    from airbnb_cache import ensure_airbnb_geo_index, ensure_airbnb_text_index, mongo_unreachable, mark_mongo_unreachable, MONGO_RETRY_SECONDS
+    from airbnb_filter_index import build_filter_index, filter_listing_positions, filter_listing_mask
+    from airbnb_search import SEARCH_MAX_RESULTS, build_search_index, search_scores, top_scored, find_text_listing_ids, text_hit_scores
+    from airbnb_amenities import build_amenity_index, has_amenities
+    from airbnb_map import MAP_MAX_MARKERS, build_listings_map
+    from airbnb_geo import find_geo_listing_ids, filter_geo_frame, build_id_index, rows_for_geo_ids
+
     col001, col002 = st.columns([10,2])
     col002.write(":orange[Note: All cost is in dollars($)]")
 
     processed_airbnb_df = st.session_state['processed_airbnb_df']
     st.header("Search Airbnb with Geospatial Visualization", divider = "rainbow")
     if processed_airbnb_df is not None:
+        # partitions sorted by price and rating, built once per dataset version and shared
+        filter_index = get_derived_airbnb_data('filter_index', shared_processed, build_filter_index)
         st.write("")
         col5, col6 = st.columns([2,3])
         col5.write("")
         col5.write("")
         col5.write("")
         col5.write("")
-        country = col5.selectbox('Select Country',sorted(processed_airbnb_df.Country.unique()), index=None, placeholder="Country")
+        country = col5.selectbox('Select Country',filter_index.countries, index=None, placeholder="Country")
         col5.write("")
-        property_type = col5.selectbox('Select Property_type',sorted(processed_airbnb_df.Property_type.unique()), index=None, placeholder="Property Type")
+        property_type = col5.selectbox('Select Property_type',filter_index.property_types, index=None, placeholder="Property Type")
         col5.write("")
         ratings = col5.slider("Select Rating range:", min_value = 0, max_value = 100, value = (0, 10), step=1)
-        minimum_price = processed_airbnb_df.Price.min()
-        maximum_price = processed_airbnb_df.Price.max()
+        minimum_price = filter_index.price_min
+        maximum_price = filter_index.price_max
         col5.write("")
         price_range = col5.slider('Select Price Range', min_value = minimum_price, max_value = maximum_price, value = (minimum_price, maximum_price), step=1.0)
         col5.write("")
+        # bitmaps of the listings having each amenity, built once per dataset version and shared
+        amenity_index = get_derived_airbnb_data('amenity_index', shared_processed, build_amenity_index)
+        must_have = col5.multiselect('Must have amenities', amenity_index.vocabulary, placeholder="Amenities")
+        col5.write("")
+        # ranks the listings left by the other filters, country and property type become optional while searching
+        search_query = col5.text_input('Search name, description and house rules', placeholder="e.g. sea view").strip()
+        search_backend = col5.radio('Search with', ['Loaded data', 'MongoDB text index'], horizontal=True, disabled=not search_query)
+        col5.write("")
+        search_mode = col5.radio('Search by', ['Country and property type', 'Distance from a location', 'Bounding box'], horizontal=True)
+        geo = None
+        if search_mode == 'Distance from a location':
+            col_lat, col_lon = col5.columns([1,1])
+            latitude = col_lat.number_input('Latitude', min_value=-90.0, max_value=90.0, value=41.39, format="%.4f")
+            longitude = col_lon.number_input('Longitude', min_value=-180.0, max_value=180.0, value=2.17, format="%.4f")
+            radius_km = col5.slider('Radius (km)', min_value=1, max_value=500, value=10)
+            nearest_first = col5.checkbox('Nearest listings first')
+            geo = dict(radius_km=radius_km, **{'near' if nearest_first else 'center': (longitude, latitude)})
+        elif search_mode == 'Bounding box':
+            col_west, col_south, col_east, col_north = col5.columns([1,1,1,1])
+            geo = dict(bbox=(col_west.number_input('West', min_value=-180.0, max_value=180.0, value=2.0, format="%.3f"),
+                             col_south.number_input('South', min_value=-90.0, max_value=90.0, value=41.3, format="%.3f"),
+                             col_east.number_input('East', min_value=-180.0, max_value=180.0, value=2.3, format="%.3f"),
+                             col_north.number_input('North', min_value=-90.0, max_value=90.0, value=41.5, format="%.3f")))
+        col5.write("")
 
-        if country is not None and property_type is not None:
-            filter_result_query = (f'Country == "{country}" & Property_type == "{property_type}" & Price >= {price_range[0]} & Price <= {price_range[1]}'
-                                f' & Review_scores >= {ratings[0]} & Review_scores <= {ratings[1]}')
-            country_df = processed_airbnb_df.query(filter_result_query).groupby(['Country'],as_index=False)['Name'].count().rename(columns={'Name' : 'Total_Listings'})
+        filtered_df = None
+        if geo is not None:
+            # country and property type are optional here, the location filter runs on the server through the 2dsphere index;
+            # ratings are imputed only in the loaded data, they are applied to the returned rows so both paths match the same listings
+            geo.update(country=country, property_type=property_type, price_range=price_range)
+            geo_ids = None
+            if mongo_unreachable():
+                col5.warning(f"MongoDB was unreachable less than {MONGO_RETRY_SECONDS} s ago, searching the loaded data instead")
+            else:
+                try:
+                    ensure_airbnb_geo_index()
+                    with perf_span('geospatial: mongodb geo query') as span:
+                        geo_ids = find_geo_listing_ids(get_airbnb_collection(), **geo)
+                        span.rows = len(geo_ids)
+                except PyMongoError as e:
+                    if isinstance(e, ConnectionFailure):
+                        mark_mongo_unreachable()
+                    col5.warning(f"MongoDB geo query failed, searching the loaded data instead : {e}")
+            if geo_ids is None:
+                with perf_span('geospatial: geo filter on loaded data') as span:
+                    geo_ids = filter_geo_frame(processed_airbnb_df, **geo)
+                    span.rows = len(geo_ids)
+            id_index = get_derived_airbnb_data('id_index', shared_processed, build_id_index)
+            with perf_span('geospatial: rows for geo ids') as span:
+                if must_have:
+                    geo_ids = geo_ids[has_amenities(amenity_index, id_index.get_indexer(geo_ids['Id']), must_have)]
+                filtered_df = rows_for_geo_ids(processed_airbnb_df, id_index, geo_ids)
+                filtered_df = filtered_df[filtered_df['Review_scores'].between(ratings[0], ratings[1])]
+                positions = id_index.get_indexer(filtered_df['Id'])
+                span.rows = len(filtered_df)
+        elif (country is not None and property_type is not None) or search_query:
+            # one indexed lookup per interaction, shared by the choropleth, the host pie and the map
+            with perf_span('geospatial: filter listings') as span:
+                if country is not None and property_type is not None:
+                    positions = filter_listing_positions(filter_index, country, property_type, price_range, ratings)
+                else:
+                    positions = np.flatnonzero(filter_listing_mask(processed_airbnb_df, filter_index, country, property_type, price_range, ratings))
+                if must_have:
+                    positions = positions[has_amenities(amenity_index, positions, must_have)]
+                filtered_df = processed_airbnb_df.iloc[positions]
+                span.rows = len(filtered_df)
+
+        if filtered_df is not None and search_query:
+            scores = None
+            if search_backend == 'MongoDB text index':
+                try:
+                    ensure_airbnb_text_index()
+                    # ratings are imputed only in the loaded data, the server narrows by the other filters and the rows above decide
+                    with perf_span('search: mongodb text query') as span:
+                        text_ids = find_text_listing_ids(get_airbnb_collection(), search_query, country=country, property_type=property_type, price_range=price_range)
+                        span.rows = len(text_ids)
+                    scores = text_hit_scores(filtered_df, text_ids)
+                except PyMongoError as e:
+                    col5.warning(f"MongoDB text search failed, searching the loaded data instead : {e}")
+            if scores is None:
+                # inverted index with bm25 weights, built once per dataset version and shared
+                search_index = get_derived_airbnb_data('search_index', shared_processed, build_search_index)
+                with perf_span('search: in-memory bm25', len(filtered_df)):
+                    scores = search_scores(search_index, search_query, positions)
+            filtered_df = top_scored(filtered_df, scores)
+            col5.caption(f"{len(filtered_df)} best matching listings (at most {SEARCH_MAX_RESULTS})")
+
+        if filtered_df is not None:
+            country_df = filtered_df.groupby(['Country'],as_index=False, observed=True)['Name'].count().rename(columns={'Name' : 'Total_Listings'})
             fig = px.choropleth(country_df,
                                 featureidkey='properties.ST_NM',
                                 locations='Country',
@@ -364,7 +436,7 @@ if page == "Geospatial Visualization":
             
             col7, col8 = st.columns([2,3])
             container_4 = col7.container(height= 800, border=False)
-            df = processed_airbnb_df.query(filter_result_query).groupby(["Host_name"]).size().reset_index(name="Listings").sort_values(by='Listings',ascending=False).head(5)
+            df = filtered_df.groupby(["Host_name"], observed=True).size().reset_index(name="Listings").sort_values(by='Listings',ascending=False).head(5)
             fig = px.pie(df,
                             title='Hosts with highest Listings',
                             values='Listings', 
@@ -376,68 +448,34 @@ if page == "Geospatial Visualization":
             fig.update_layout(showlegend=True)
             container_4.plotly_chart(fig, use_container_width=True)
 
-            country_df = processed_airbnb_df[(processed_airbnb_df["Country"] == country) & (processed_airbnb_df["Property_type"] == property_type) & 
-                                            (processed_airbnb_df["Price"] >= price_range[0]) & (processed_airbnb_df["Price"] <= price_range[1]) & 
-                                            (processed_airbnb_df["Review_scores"] >= ratings[0]) & (processed_airbnb_df["Review_scores"] <= ratings[1])]
-
-            names = country_df['Name'].values
-            reviews = country_df['Number_of_reviews'].values
-            ratings = country_df['Review_scores'].values
-            price = country_df['Price'].values
-            bedrooms = country_df['Total_bedrooms'].values
-            room_type = country_df['Room_type'].values
-            accommodates = country_df['Accommodates'].values
-            security_deposit = country_df['Security_deposit'].values
-            host_name = country_df['Host_name'].values
-            latitudes = country_df['Latitude'].values
-            longitudes = country_df['Longitude'].values
-
             container_5 = col8.container(border=True)
-            if len(latitudes) != 0:
+            if len(filtered_df) != 0:
                 with container_5:
                     st.subheader("View Airbnb on Map")
-                    # Set initial location and zoom level
-                    initial_location = [latitudes[0], longitudes[0]]
-                    zoom_level = 1
-
-                    # Create the Folium map
-                    folium_map = folium.Map(
-                    location=initial_location,
-                    zoom_start=zoom_level,
-                    tiles='CartoDB Voyager',
-                    control_scale=True
-                    )
-
-                    # Adding a marker cluster
-                    marker_cluster = MarkerCluster().add_to(folium_map)
-
-                    # Add markers to the map
-                    for i in range(len(names)):
-
-                        popup_content = (f'<b>{names[i]}</b><br>'
-                                        f'Host Name: {host_name[i]}<br>'
-                                        f'Price: ${price[i]}<br>'
-                                        f'Number of Reviews: {reviews[i]}<br>'
-                                        f'Rating: {ratings[i]}<br>'
-                                        f'Bedrooms: {bedrooms[i]}<br>'
-                                        f'Room Type: {room_type[i]}<br>'
-                                        f'Accommodates: {accommodates[i]}<br>'
-                                        f'Security Deposit: ${security_deposit[i]}')
-                        popup = folium.Popup(popup_content, max_width=300)
-
-                        folium.Marker(
-                            location=[latitudes[i], longitudes[i]],
-                            popup=popup,
-                            icon=folium.Icon(color='blue', icon='info-sign')
-                        ).add_to(marker_cluster)
+                    # markers are built in bulk in the browser, large results are pre-clustered on a grid
+                    with perf_span('map: build', len(filtered_df)):
+                        folium_map = build_listings_map(filtered_df)
+                    if len(filtered_df) > MAP_MAX_MARKERS:
+                        st.caption(f"{len(filtered_df)} listings, grouped into map cells")
                 
-                    st_folium(folium_map, use_container_width=True)
+                    # st_folium renders the map to html and sends it to the browser
+                    with perf_span('map: render', len(filtered_df)):
+                        st_folium(folium_map, use_container_width=True)
+
+            if search_query:
+                container_10 = st.container(border=True)
+                container_10.subheader(f"Listings matching \"{search_query}\"")
+                container_10.dataframe(filtered_df[['Name', 'Country', 'Property_type', 'Price', 'Review_scores', 'Score']], use_container_width=True, hide_index=True)
     else:
         st.warning("Processed Data Not Available!")
 
 
 if page == "Advanced Analysis":
 
+    import plotly.express as px
+    from airbnb_aggregates import build_airbnb_cube, filter_processed_airbnb_df
+    from airbnb_amenities import AMENITY_LIFT_MIN_LISTINGS, build_amenity_index, amenity_price_lift
+
     col001, col002 = st.columns([10,2])
     col002.write(":orange[Note: All cost is in dollars($)]")
     
@@ -445,7 +483,10 @@ if page == "Advanced Analysis":
     st.header("Advanced Analysis of the Airbnb Data", divider = "rainbow")
     if processed_airbnb_df is not None:
 
-        country_mean_price, property_mean_price, country_availability_mean, room_type_property_mean_price, hotel_count_by_property, preferred_property_country = filter_processed_airbnb_df(processed_airbnb_df)
+        # the aggregate cube is built once per dataset version and shared, the charts only roll it up
+        airbnb_cube = get_derived_airbnb_data('cube', shared_processed, build_airbnb_cube)
+        with perf_span('aggregates: filter_processed_airbnb_df', len(processed_airbnb_df)):
+            country_mean_price, property_mean_price, country_availability_mean, room_type_property_mean_price, hotel_count_by_property, preferred_property_country = filter_processed_airbnb_df(processed_airbnb_df, airbnb_cube)
 
         container_6 = st.container(border=True)
         col9, col10 = container_6.columns([1,1])
@@ -512,5 +553,70 @@ if page == "Advanced Analysis":
             title = "Average Price For Each Property Type")
         col10.plotly_chart(fig)
 
+        # mean price with an amenity over the mean price without it, from the amenity index instead of the joined strings
+        amenity_index = get_derived_airbnb_data('amenity_index', shared_processed, build_amenity_index)
+        amenity_lift = get_derived_airbnb_data('amenity_lift', shared_processed, lambda df: amenity_price_lift(amenity_index, df))
+        container_9 = st.container(border=True)
+        col13, col14 = container_9.columns([1,3])
+        lift_country = col13.selectbox('Amenity price lift in', amenity_lift['Country'].unique())
+        lift_count = col13.slider('Amenities shown', min_value=5, max_value=50, value=15)
+        col13.caption(f"Amenities found on (and missing from) at least {AMENITY_LIFT_MIN_LISTINGS} listings. Lift above 1 means listings with the amenity are priced higher on average.")
+        country_lift = amenity_lift[amenity_lift['Country'] == lift_country].sort_values('Lift')
+        country_lift = pd.concat([country_lift.head(lift_count), country_lift.tail(lift_count)]).drop_duplicates('Amenity')
+        fig = px.bar(country_lift,
+                    x="Lift",
+                    y="Amenity",
+                    orientation="h",
+                    color="Share",
+                    hover_data=["Listings", "Price_with", "Price_without"],
+                    height=max(400, 22 * len(country_lift)),
+                    title = f"Amenities With the Highest and Lowest Price Lift ({lift_country})")
+        fig.add_vline(x=1, line_dash="dash")
+        col14.plotly_chart(fig, use_container_width=True)
+
+    else:
+        st.warning("Processed Data Not Available!")
+
+if page == "Performance":
+
+    import plotly.express as px
+    from airbnb_instrumentation import PERF_MAX_SPANS, PERF_TRACE_MEMORY_ENV, PerfSpan, recent_spans, clear_spans, spans_to_jsonl, memory_tracing
+
+    st.header("Timing and Memory of Recent Reruns", divider = "rainbow")
+    col11, col12 = st.columns([1,3])
+    # tracing is process wide and slows allocation heavy stages down for every session, no session can switch it
+    if memory_tracing():
+        col11.caption("Peak memory is traced for every session of this app process")
+    else:
+        col11.caption(f"Peak memory is not traced, start the app with {PERF_TRACE_MEMORY_ENV}=1 to trace it for every session")
+    all_sessions = col11.toggle("Include other sessions")
+    if col11.button("Clear recorded spans", use_container_width = True):
+        clear_spans()
+    spans = recent_spans(None if all_sessions else st.session_state['perf_session'])
+    col11.download_button("Export as JSON lines", spans_to_jsonl(spans), file_name="airbnb_perf.jsonl", mime="application/x-ndjson",
+                          use_container_width = True)
+    col11.caption(f"Last {PERF_MAX_SPANS} spans of this app process. Every span is also logged as one json object by the 'airbnb.perf' logger at INFO level.")
+
+    if spans:
+        spans_df = pd.DataFrame(spans, columns=PerfSpan._fields)
+        # nested spans are part of their parent's time, only top level spans add up to the rerun
+        spans_df['top_level_seconds'] = spans_df['seconds'].where(spans_df['parent'].isna(), 0)
+        reruns = spans_df.groupby('rerun', sort=False).agg(started=('started', 'min'), page=('page', 'first'), stages=('stage', 'size'),
+                                                           seconds=('top_level_seconds', 'sum'), peak_mb=('peak_mb', 'max'))
+        reruns = reruns.sort_values('started', ascending=False)
+
+        container_7 = col12.container(border=True)
+        container_7.subheader("Reruns, newest first")
+        container_7.dataframe(reruns.round(3), use_container_width=True)
+        rerun = container_7.selectbox("Stages of rerun", reruns.index, format_func=lambda rerun: f"{reruns.loc[rerun, 'started']} {reruns.loc[rerun, 'page']}")
+        container_7.dataframe(spans_df.loc[spans_df['rerun'] == rerun, ['stage', 'parent', 'seconds', 'rows', 'peak_mb']], use_container_width=True, hide_index=True)
+
+        container_8 = st.container(border=True)
+        container_8.subheader("Latency by stage")
+        stages = spans_df.groupby('stage').agg(runs=('seconds', 'size'), median_s=('seconds', 'median'), p95_s=('seconds', lambda seconds: seconds.quantile(0.95)),
+                                               max_s=('seconds', 'max'), last_rows=('rows', 'last'), max_peak_mb=('peak_mb', 'max'))
+        container_8.dataframe(stages.sort_values('median_s', ascending=False).round(4), use_container_width=True)
+        fig = px.box(spans_df, x='seconds', y='stage', points='all', log_x=True, height=max(400, 30 * len(stages)))
+        container_8.plotly_chart(fig, use_container_width=True)
     else:
-        st.warning("Processed Data Not Available!")
\ No newline at end of file
+        col12.info("No stages timed yet, use the other pages first.")
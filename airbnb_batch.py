@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from pymongo import MongoClient
+
+from airbnb_extraction import MONGO_URI, AIRBNB_DB, AIRBNB_COLLECTION, extract_airbnb_data
+from airbnb_preprocessing import AirbnbImputer, convert_airbnb_dtypes, concat_airbnb_frames, fill_missing_airbnb_data
+from airbnb_aggregates import build_airbnb_cube, filter_processed_airbnb_df
+from airbnb_snapshot import (SNAPSHOT_DIR, SNAPSHOT_WATERMARK_FIELD, MANIFEST_FILE, latest_watermark, new_snapshot_version, write_snapshot,
+                             write_parquet_atomic, encode_watermark, watermark_match)
+
+# processed listings partitioned by Country plus the Advanced Analysis tables, for Power BI and other readers
+BATCH_OUTPUT_DIR = "airbnb_batch"
+LISTINGS_DIR = "listings"
+AGGREGATES_DIR = "aggregates"
+# names of the frames returned by filter_processed_airbnb_df, in order
+AGGREGATE_TABLES = ['country_mean_price', 'property_mean_price', 'country_availability_mean', 'room_type_property_mean_price',
+                    'hotel_count_by_property', 'preferred_property_country']
+
+_worker_collection = None
+
+
+def init_worker(uri):
+
+    # one client per worker process, pymongo clients must not be shared across a fork
+    global _worker_collection
+    _worker_collection = MongoClient(uri)[AIRBNB_DB][AIRBNB_COLLECTION]
+
+
+def extract_country(country, match):
+
+    # extraction, type conversion and the gap filling statistics of one country, the expensive per document work
+    start = time.perf_counter()
+    extracted_df = convert_airbnb_dtypes(extract_airbnb_data(_worker_collection, match=dict(match, **{'address.country': country})))
+    return country, extracted_df, AirbnbImputer().fit(extracted_df), time.perf_counter() - start
+
+
+def country_partitions(collection, match):
+
+    # listings per country, largest first so the longest partitions start early and the pool drains evenly
+    counts = collection.aggregate([{'$match': match}, {'$group': {'_id': '$address.country', 'listings': {'$sum': 1}}}])
+    return sorted(((data['_id'], data['listings']) for data in counts), key=lambda partition: -partition[1])
+
+
+def extract_by_country(uri, partitions, match, workers):
+
+    frames, timings = {}, {}
+    # per country statistics merge into exactly the statistics of all listings
+    imputer = AirbnbImputer()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(uri,)) as pool:
+        futures = [pool.submit(extract_country, country, match) for country, listings in partitions]
+        for future in as_completed(futures):
+            country, extracted_df, country_imputer, seconds = future.result()
+            frames[country], timings[country] = extracted_df, seconds
+            imputer.merge(country_imputer)
+            print(f"{country}: {len(extracted_df)} listings in {seconds:.1f} s")
+    # concatenated in a fixed order so repeated runs give the same row order
+    return concat_airbnb_frames([frames[country] for country, listings in partitions if country in frames]), imputer, timings
+
+
+def replace_directory(build, path):
+
+    # everything is written next to the old output first, readers never see a half written directory. The old output is
+    # renamed aside and only deleted once the new one is in place, so path is missing only between two renames, and a
+    # crash there leaves the old output to be restored by the next run
+    temp_path, old_path = path + ".tmp", path + ".old"
+    if not os.path.exists(path) and os.path.exists(old_path):
+        os.replace(old_path, path)
+    shutil.rmtree(temp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    build(temp_path)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(temp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def write_listings(processed_df, directory):
+
+    replace_directory(lambda path: processed_df.to_parquet(path, engine="pyarrow", index=False, partition_cols=['Country']), directory)
+
+
+def write_aggregates(processed_df, directory):
+
+    cube = build_airbnb_cube(processed_df)
+    tables = dict(zip(AGGREGATE_TABLES, filter_processed_airbnb_df(processed_df, cube)), cube=cube)
+
+    def build(path):
+        for name, table in tables.items():
+            write_parquet_atomic(table, os.path.join(path, f"{name}.parquet"))
+
+    replace_directory(build, directory)
+    return sorted(tables)
+
+
+def run_batch(uri=MONGO_URI, output_dir=BATCH_OUTPUT_DIR, snapshot_dir=SNAPSHOT_DIR, workers=None, watermark_field=SNAPSHOT_WATERMARK_FIELD):
+
+    start = time.perf_counter()
+    collection = MongoClient(uri)[AIRBNB_DB][AIRBNB_COLLECTION]
+    # every worker reads up to the same watermark, listings scraped while the batch runs are left for the next refresh
+    watermark = latest_watermark(collection, watermark_field)
+    match = watermark_match(watermark_field, watermark) or {}
+    partitions = country_partitions(collection, match)
+    extracted_df, imputer, timings = extract_by_country(uri, partitions, match, workers or os.cpu_count())
+    extract_seconds = time.perf_counter() - start
+
+    # gaps are filled with the statistics of every listing, merged from the workers
+    version = new_snapshot_version()
+    if snapshot_dir:
+        # the streamlit app starts from this snapshot and can refresh it incrementally
+        processed_df, snapshot_manifest = write_snapshot(extracted_df, snapshot_dir, watermark_field, watermark, version, imputer=imputer)
+    else:
+        processed_df = fill_missing_airbnb_data(extracted_df.copy(), imputer)
+
+    os.makedirs(output_dir, exist_ok=True)
+    write_listings(processed_df, os.path.join(output_dir, LISTINGS_DIR))
+    tables = write_aggregates(processed_df, os.path.join(output_dir, AGGREGATES_DIR))
+
+    manifest = {'version': version,
+                'created': datetime.now(timezone.utc).isoformat(),
+                'rows': len(processed_df),
+                'fill_values': imputer.fill_values(),
+                'countries': {country: listings for country, listings in partitions},
+                'aggregates': tables,
+                'watermark_field': watermark_field,
+                'watermark': encode_watermark(watermark),
+                'workers': workers or os.cpu_count(),
+                'extract_seconds': round(extract_seconds, 3),
+                'country_seconds': {country: round(seconds, 3) for country, seconds in timings.items()},
+                'total_seconds': round(time.perf_counter() - start, 3)}
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Extract, preprocess and aggregate the airbnb listings without the Streamlit app")
+    parser.add_argument('--uri', default=MONGO_URI)
+    parser.add_argument('--output', default=BATCH_OUTPUT_DIR, help="listings partitioned by Country and the aggregate tables")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR, help="snapshot read by the Streamlit app, empty to skip")
+    parser.add_argument('--workers', type=int, default=None, help="extraction processes, defaults to the number of cores")
+    args = parser.parse_args()
+
+    manifest = run_batch(args.uri, args.output, args.snapshot_dir, args.workers)
+    print(f"{manifest['rows']} listings from {len(manifest['countries'])} countries in {manifest['total_seconds']} s, version {manifest['version']}")
+
+
+if __name__ == "__main__":
+    main()
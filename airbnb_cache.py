@@ -0,0 +1,186 @@
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import pandas as pd
+import streamlit as st
+from cachetools import TTLCache
+
+from airbnb_extraction import MONGO_URI, AIRBNB_DB, AIRBNB_COLLECTION
+from airbnb_snapshot import load_snapshot
+from airbnb_instrumentation import perf_span
+
+# process wide cache shared by every streamlit session, entries expire after the ttl or when the byte budget is exceeded
+SHARED_DATA_TTL = 60 * 60
+SHARED_DATA_MAX_BYTES = 4 * 1024 ** 3
+# the datasets sessions load, everything else (indexes, cube, statistics) is derived from them and has its own budget so
+# rebuilding a derived structure never pushes a dataset out
+SHARED_DATASETS = ('extracted', 'processed')
+SHARED_DERIVED_MAX_BYTES = 2 * 1024 ** 3
+MONGO_MAX_POOL_SIZE = 20
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+# after a failed connection the server is not tried again for this long, every rerun would otherwise wait for the timeout
+MONGO_RETRY_SECONDS = 60
+# rendered EDA figures kept as png, a few layouts of a few dataset versions
+EDA_RENDER_MAX_ENTRIES = 128
+
+# one immutable dataset (or a structure derived from it), sessions only keep a reference to it and must not modify df in place
+SharedAirbnbData = namedtuple('SharedAirbnbData', ['version', 'df', 'converted', 'manifest'])
+
+
+@st.cache_resource(show_spinner=False)
+def get_mongo_client(uri=MONGO_URI):
+
+    # a single pooled client per process instead of a new connection per button click
+    # pymongo is imported on first use, pages that never reach the database do not load it
+    from pymongo import MongoClient
+    return MongoClient(uri, maxPoolSize=MONGO_MAX_POOL_SIZE, serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS)
+
+
+def get_airbnb_collection():
+
+    return get_mongo_client()[AIRBNB_DB][AIRBNB_COLLECTION]
+
+
+_mongo_unreachable_until = 0.0
+
+
+def mongo_unreachable():
+
+    return time.monotonic() < _mongo_unreachable_until
+
+
+def mark_mongo_unreachable():
+
+    # process wide, one session finding the server down spares the others the wait
+    global _mongo_unreachable_until
+    _mongo_unreachable_until = time.monotonic() + MONGO_RETRY_SECONDS
+
+
+@st.cache_resource(show_spinner=False)
+def ensure_airbnb_geo_index():
+
+    # created once per process, later calls are free
+    from airbnb_geo import ensure_geo_index
+    return ensure_geo_index(get_airbnb_collection())
+
+
+@st.cache_resource(show_spinner=False)
+def ensure_airbnb_text_index():
+
+    from airbnb_search import ensure_text_index
+    return ensure_text_index(get_airbnb_collection())
+
+
+def new_dataset_version():
+
+    return uuid.uuid4().hex[:12]
+
+
+def shared_data_nbytes(entry):
+
+    # frames report their deep memory usage, derived structures (filter index, ...) carry an nbytes field
+    if isinstance(entry.df, pd.DataFrame):
+        return max(int(entry.df.memory_usage(deep=True).sum()), 1)
+    return max(int(entry.df.nbytes), 1)
+
+
+_shared_data = TTLCache(maxsize=SHARED_DATA_MAX_BYTES, ttl=SHARED_DATA_TTL, getsizeof=shared_data_nbytes)
+_shared_derived = TTLCache(maxsize=SHARED_DERIVED_MAX_BYTES, ttl=SHARED_DATA_TTL, getsizeof=shared_data_nbytes)
+_shared_data_lock = threading.Lock()
+_loader_locks = {}
+
+
+def loader_lock(name):
+
+    with _shared_data_lock:
+        return _loader_locks.setdefault(name, threading.Lock())
+
+
+def shared_cache(name):
+
+    return _shared_data if name in SHARED_DATASETS else _shared_derived
+
+
+def put_shared_airbnb_data(name, entry):
+
+    with _shared_data_lock:
+        try:
+            shared_cache(name)[name] = entry
+        except ValueError:
+            # larger than the whole budget, the caller still gets its data but it is not shared
+            shared_cache(name).pop(name, None)
+    return entry
+
+
+def is_shared_airbnb_data(name, entry):
+
+    with _shared_data_lock:
+        return entry is not None and shared_cache(name).get(name) is entry
+
+
+def get_shared_airbnb_data(name, loader=None):
+
+    with _shared_data_lock:
+        entry = shared_cache(name).get(name)
+    if entry is not None or loader is None:
+        return entry
+
+    # only one session runs the loader, concurrent sessions wait and reuse its result
+    with loader_lock(name):
+        with _shared_data_lock:
+            entry = shared_cache(name).get(name)
+        if entry is None:
+            entry = loader()
+            if entry is not None:
+                put_shared_airbnb_data(name, entry)
+    return entry
+
+
+def evict_shared_airbnb_data(*names):
+
+    with _shared_data_lock:
+        for name in names or list(_shared_data) + list(_shared_derived):
+            shared_cache(name).pop(name, None)
+
+
+def load_snapshot_airbnb_data():
+
+    processed_df, manifest = load_snapshot()
+    if processed_df is None:
+        return None
+    return SharedAirbnbData(manifest['version'], processed_df, True, manifest)
+
+
+def get_versioned_airbnb_data(name, version, builder):
+
+    # shared entries rebuilt as soon as their source has a new version, builder takes no argument
+    entry = get_shared_airbnb_data(name)
+    if entry is None or entry.version != version:
+        evict_shared_airbnb_data(name)
+        entry = get_shared_airbnb_data(name, lambda: SharedAirbnbData(version, builder(), True, None))
+    return entry.df
+
+
+def get_derived_airbnb_data(name, shared_processed, builder):
+
+    # structures built from the processed data are rebuilt as soon as the processed data has a new version
+    return get_versioned_airbnb_data(name, shared_processed.version, lambda: build_derived_airbnb_data(name, shared_processed, builder))
+
+
+def build_derived_airbnb_data(name, shared_processed, builder):
+
+    with perf_span(f"derived: {name}", len(shared_processed.df)):
+        return builder(shared_processed.df)
+
+
+@st.cache_data(max_entries=EDA_RENDER_MAX_ENTRIES, show_spinner=False)
+def render_eda_png(version, figure, layout, _source):
+
+    # keyed by dataset version and layout only, _source is not hashed; matplotlib and seaborn load with the first figure
+    # only renders are timed, cache hits cost nothing
+    from airbnb_eda import EDA_FIGURES, figure_to_png
+    with perf_span(f"eda: {figure}" if layout is None else f"eda: {figure} ({layout})",
+                   len(_source) if isinstance(_source, pd.DataFrame) else None):
+        return figure_to_png(EDA_FIGURES[figure](_source, layout))
@@ -0,0 +1,250 @@
+import io
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+import seaborn as sns
+
+from airbnb_sketches import HISTOGRAM_COLUMNS, BOXPLOT_COLUMNS, COUNT_PLOTS, eda_stats_from_chunks
+
+# above this many listings the relationship plots switch to hexbin densities and stratified samples
+SCATTER_MAX_POINTS = 5000
+SCATTER_HEXBIN_GRIDSIZE = 50
+SCATTER_OVERLAY_BINS = 30
+SCATTER_OVERLAY_MIN_ROWS = 20
+SCATTER_OUTLIER_SHARE = 0.1
+# st.image passes images up to its maximum content width through unchanged and resizes wider ones on every call
+EDA_PNG_MAX_WIDTH = 1460
+EDA_PNG_DPI = 200
+EDA_PNG_PAD_INCHES = 0.1
+
+
+def compute_eda_stats(processed_airbnb_df):
+
+    # the same one pass statistics engine that streams larger than memory sources, on a single chunk
+    return eda_stats_from_chunks([processed_airbnb_df])
+
+
+def grid_axes(panels, cols_in_grid):
+
+    rows_in_grid = (panels + cols_in_grid - 1) // cols_in_grid
+    fig = Figure(figsize=(15, 5 * rows_in_grid))
+    axes = fig.subplots(rows_in_grid, cols_in_grid)
+    axes = np.atleast_1d(axes).flatten()
+    for j in range(panels, len(axes)):
+        fig.delaxes(axes[j])
+    return fig, axes
+
+
+def histogram_figure(eda_stats, cols_in_grid):
+
+    fig, axes = grid_axes(len(HISTOGRAM_COLUMNS), cols_in_grid)
+    for i, column in enumerate(HISTOGRAM_COLUMNS):
+        histogram = eda_stats.histograms[column]
+        axes[i].bar(histogram.edges[:-1], histogram.counts, width=np.diff(histogram.edges), align='edge', color='C0', alpha=0.5, edgecolor='white')
+        axes[i].plot(histogram.kde_x, histogram.kde_y, color='C0')
+        axes[i].set_title(column)
+        axes[i].set_xlabel(column)
+        axes[i].set_ylabel('Frequency')
+    fig.tight_layout()
+    return fig
+
+
+def boxplot_figure(eda_stats, cols_in_grid):
+
+    fig, axes = grid_axes(len(BOXPLOT_COLUMNS), cols_in_grid)
+    for i, column in enumerate(BOXPLOT_COLUMNS):
+        axes[i].bxp([eda_stats.boxes[column]], widths=0.8, patch_artist=True,
+                    boxprops={'facecolor': 'C0'}, medianprops={'color': '#333333'}, flierprops={'marker': 'd', 'markerfacecolor': '#333333'})
+        axes[i].set_xticks([])
+        axes[i].set_ylabel(column)
+        axes[i].set_title(column)
+    fig.tight_layout()
+    return fig
+
+
+def count_figure(eda_stats, column):
+
+    column, orient, palette, title, figsize, by_count = next(plot for plot in COUNT_PLOTS if plot[0] == column)
+    column_counts = eda_stats.counts[column]
+    colors = sns.color_palette(palette, len(column_counts))
+    labels = [str(label) for label in column_counts.index]
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    if orient == 'x':
+        ax.bar(labels, column_counts.to_numpy(), color=colors)
+        ax.set_xlabel(column)
+        ax.set_ylabel('count')
+    else:
+        ax.barh(labels, column_counts.to_numpy(), color=colors)
+        ax.invert_yaxis()
+        ax.set_ylabel(column)
+        ax.set_xlabel('count')
+    ax.set_title(title)
+    return fig
+
+
+def heatmap_figure(eda_stats, layout=None):
+
+    fig = Figure(figsize=(12, 8))
+    ax = fig.subplots()
+    sns.heatmap(eda_stats.corr, annot=True, cmap='viridis', vmin=-1, vmax=1, ax=ax)
+    ax.set_title('Correlation Heatmap')
+    return fig
+
+
+def binned_median(x, y, bins=SCATTER_OVERLAY_BINS):
+
+    # median of y in equal width bins of x over every row, for the line drawn on top of the density and sample views;
+    # bins with too few rows to give a stable median are left out
+    low, high = np.nanmin(x), np.nanmax(x)
+    positions = np.floor((x - low) / max(high - low, 1e-9) * bins).clip(0, bins - 1)
+    grouped = pd.Series(y).groupby(positions)
+    medians = grouped.median()[grouped.size() >= SCATTER_OVERLAY_MIN_ROWS]
+    return low + (medians.index.to_numpy() + 0.5) * (high - low) / bins, medians.to_numpy()
+
+
+def stratified_sample(processed_airbnb_df, by, columns, max_points=SCATTER_MAX_POINTS, seed=0):
+
+    # every category keeps a share of the sample proportional to its size (at least one row), within a category its
+    # strongest outliers on the plotted columns are taken first (up to SCATTER_OUTLIER_SHARE of it) and the rest is drawn at random
+    groups = processed_airbnb_df[by].cat.codes.to_numpy() if processed_airbnb_df[by].dtype == 'category' \
+        else pd.factorize(processed_airbnb_df[by])[0]
+    sizes = np.bincount(groups)
+    quota = np.maximum(np.floor(sizes * max_points / len(groups)), np.minimum(sizes, 1)).astype(np.int64)
+
+    score = np.zeros(len(groups))
+    for column in columns:
+        values = processed_airbnb_df[column].to_numpy(dtype=np.float64)
+        quartiles = pd.Series(values).groupby(groups).quantile([0.25, 0.75]).unstack()
+        q1 = quartiles[0.25].reindex(range(len(sizes))).to_numpy()[groups]
+        q3 = quartiles[0.75].reindex(range(len(sizes))).to_numpy()[groups]
+        iqr = np.maximum(q3 - q1, 1e-9)
+        score = np.maximum(score, np.maximum(q1 - 1.5 * iqr - values, values - q3 - 1.5 * iqr) / iqr)
+
+    # only outliers and a random draw of about twice the share are ranked, so the sort does not grow with the data
+    rng = np.random.default_rng(seed)
+    draw = rng.random(len(groups))
+    drawn = draw < 2 * quota[groups] / sizes[groups]
+    candidates = np.flatnonzero((score > 0) | drawn)
+    candidate_groups, candidate_score = groups[candidates], score[candidates]
+    outlier_rank = pd.Series(-candidate_score).groupby(candidate_groups).rank(method='first').to_numpy()
+    keep_outlier = (candidate_score > 0) & (outlier_rank <= np.ceil(quota[candidate_groups] * SCATTER_OUTLIER_SHARE))
+    # outliers beyond their part of the share only come back through the random draw, like any other row
+    priority = np.where(keep_outlier, 1 + candidate_score, np.where(drawn[candidates], draw[candidates], -1))
+    order = np.lexsort((-priority, candidate_groups))
+    candidate_sizes = np.bincount(candidate_groups, minlength=len(sizes))
+    rank_in_group = np.arange(len(order)) - np.repeat(np.cumsum(candidate_sizes) - candidate_sizes, candidate_sizes)
+    selected = (rank_in_group < quota[candidate_groups[order]]) & (priority[order] >= 0)
+    return processed_airbnb_df.iloc[np.sort(candidates[order[selected]])]
+
+
+def density_panel(ax, processed_airbnb_df, x, y, title):
+
+    # hexagonal bin counts over every row, the drawing cost depends on the grid not on the number of listings
+    x_values = processed_airbnb_df[x].to_numpy(dtype=np.float64)
+    y_values = processed_airbnb_df[y].to_numpy(dtype=np.float64)
+    cells = ax.hexbin(x_values, y_values, gridsize=SCATTER_HEXBIN_GRIDSIZE, bins='log', mincnt=1, cmap='Blues')
+    ax.figure.colorbar(cells, ax=ax, label='listings')
+    ax.plot(*binned_median(x_values, y_values), color='#d62728', label=f'median {y}')
+    ax.legend(loc='upper right')
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    ax.set_title(title)
+
+
+def sample_caption(sample, processed_airbnb_df):
+
+    # every stratified sample has its own size, each panel is captioned with the one it draws
+    return f'{len(sample):,} of {len(processed_airbnb_df):,} listings'
+
+
+def large_scatter_figure(processed_airbnb_df):
+
+    fig = Figure(figsize=(15, 15))
+    axes = fig.subplots(3, 2)
+
+    density_panel(axes[0, 0], processed_airbnb_df, 'Review_scores', 'Price', 'Review Scores Vs Price')
+    density_panel(axes[0, 1], processed_airbnb_df, 'Accommodates', 'Price', 'Accommodates Vs Price')
+    density_panel(axes[1, 0], processed_airbnb_df, 'Availability_365', 'Price', 'Availability_365 Vs Price')
+
+    # plots with a category or size encoding keep it on a stratified sample, the medians still come from every row
+    property_types = processed_airbnb_df['Property_type'].astype(str)
+    order = property_types.value_counts().index.tolist()
+    positions = pd.Series(np.arange(len(order)), index=order)
+    sample = stratified_sample(processed_airbnb_df, 'Property_type', ['Price'])
+    axes[1, 1].scatter(positions[sample['Property_type'].astype(str)].to_numpy(), sample['Price'], s=12, alpha=0.5)
+    medians = processed_airbnb_df['Price'].groupby(property_types).median()[order]
+    axes[1, 1].scatter(positions.to_numpy(), medians.to_numpy(), marker='D', color='#d62728', label='median Price')
+    axes[1, 1].set_xticks(positions.to_numpy(), order, rotation=90)
+    axes[1, 1].legend(loc='upper right')
+    axes[1, 1].set_xlabel('Property_type')
+    axes[1, 1].set_ylabel('Price')
+    axes[1, 1].set_title(f'Property Type Vs Price ({sample_caption(sample, processed_airbnb_df)})')
+
+    sample = stratified_sample(processed_airbnb_df, 'Accommodates', ['Number_of_reviews', 'Price'])
+    sns.scatterplot(x='Number_of_reviews', y='Price', size='Accommodates', data=sample, ax=axes[2, 0])
+    axes[2, 0].plot(*binned_median(processed_airbnb_df['Number_of_reviews'].to_numpy(dtype=np.float64),
+                                   processed_airbnb_df['Price'].to_numpy(dtype=np.float64)), color='#d62728')
+    axes[2, 0].set_title(f'Number of Reviews Vs Price ({sample_caption(sample, processed_airbnb_df)})')
+
+    sample = stratified_sample(processed_airbnb_df, 'Property_type', ['Price', 'Review_scores'])
+    price_review = sns.scatterplot(x='Price', y='Review_scores', hue='Property_type', hue_order=order, data=sample, ax=axes[2, 1])
+    axes[2, 1].plot(*binned_median(processed_airbnb_df['Price'].to_numpy(dtype=np.float64),
+                                   processed_airbnb_df['Review_scores'].to_numpy(dtype=np.float64)), color='#d62728')
+    axes[2, 1].set_title(f'Price vs. Review Scores (Upon Property Type, {sample_caption(sample, processed_airbnb_df)})')
+    price_review.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    fig.tight_layout()
+    return fig
+
+
+def scatter_figure(processed_airbnb_df, layout=None):
+
+    if len(processed_airbnb_df) > SCATTER_MAX_POINTS:
+        return large_scatter_figure(processed_airbnb_df)
+
+    fig = Figure(figsize=(15, 15))
+    axes = fig.subplots(3, 2)
+
+    sns.scatterplot(x='Review_scores', y='Price', data=processed_airbnb_df, ax=axes[0, 0])
+    axes[0, 0].set_title('Review Scores Vs Price')
+
+    sns.scatterplot(x='Accommodates', y='Price', data=processed_airbnb_df, ax=axes[0, 1])
+    axes[0, 1].set_title('Accommodates Vs Price')
+
+    sns.scatterplot(x='Availability_365', y='Price', data=processed_airbnb_df, ax=axes[1, 0])
+    axes[1, 0].set_title('Availability_365 Vs Price')
+
+    sns.scatterplot(x='Property_type', y='Price', data=processed_airbnb_df, ax=axes[1, 1])
+    axes[1, 1].set_xticklabels(axes[1, 1].get_xticklabels(), rotation=90)
+    axes[1, 1].set_title('Property Type Vs Price')
+
+    sns.scatterplot(x='Number_of_reviews', y='Price', size='Accommodates', data=processed_airbnb_df, ax=axes[2, 0])
+    axes[2, 0].set_title('Number of Reviews Vs Price')
+
+    price_review = sns.scatterplot(x='Price', y='Review_scores', hue='Property_type', data=processed_airbnb_df, ax=axes[2, 1])
+    axes[2, 1].set_title('Price vs. Review Scores (Upon Property Type)')
+    price_review.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    fig.tight_layout()
+    return fig
+
+
+# figure name -> drawing function(source, layout), source is the EdaStats or for scatter plots the processed data
+EDA_FIGURES = {'histograms': histogram_figure,
+               'boxplots': boxplot_figure,
+               'count': count_figure,
+               'heatmap': heatmap_figure,
+               'scatter': scatter_figure}
+
+
+def figure_to_png(fig, max_width=EDA_PNG_MAX_WIDTH):
+
+    # same options as st.pyplot, figures are not registered with pyplot so renders from several sessions do not share state.
+    # the dpi is lowered for wide figures so the png is at most max_width pixels wide: st.image resizes wider images on
+    # every rerun, which would cost more than rendering them
+    bbox = fig.get_tightbbox()
+    width_inches = bbox.width + 2 * EDA_PNG_PAD_INCHES
+    dpi = min(EDA_PNG_DPI, int(max_width / width_inches) - 1)
+    image = io.BytesIO()
+    fig.savefig(image, bbox_inches="tight", pad_inches=EDA_PNG_PAD_INCHES, dpi=dpi, format="png")
+    return image.getvalue()
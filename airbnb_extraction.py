@@ -0,0 +1,184 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+# MongoDB connection details for the airbnb sample dataset
+MONGO_URI = "mongodb://localhost:27017"
+AIRBNB_DB = "sample_airbnb"
+AIRBNB_COLLECTION = "listingsAndReviews"
+
+# documents per round trip, large enough to keep the network busy but small enough to keep cursor memory low
+AIRBNB_BATCH_SIZE = 2000
+# listings per dataframe in streaming mode
+AIRBNB_CHUNK_SIZE = 5000
+# cursors read at the same time in parallel mode
+AIRBNB_EXTRACT_WORKERS = 4
+
+# output column -> field path (or expression) in listingsAndReviews, in the order of the extracted dataframe
+AIRBNB_FIELDS = {
+    'Id': '$_id',
+    'Listing_url': '$listing_url',
+    'Name': '$name',
+    'Description': '$description',
+    'House_rules': '$house_rules',
+    'Property_type': '$property_type',
+    'Room_type': '$room_type',
+    'Bed_type': '$bed_type',
+    'Minimum_nights': '$minimum_nights',
+    'Maximum_nights': '$maximum_nights',
+    'Cancellation_policy': '$cancellation_policy',
+    'Accommodates': '$accommodates',
+    'Total_bedrooms': '$bedrooms',
+    'Total_beds': '$beds',
+    'Number_of_reviews': '$number_of_reviews',
+    'Amenities': '$amenities',
+    'Price': '$price',
+    'Security_deposit': '$security_deposit',
+    'Cleaning_fee': '$cleaning_fee',
+    'Extra_people': '$extra_people',
+    'Guests_included': '$guests_included',
+    'Host_id': '$host.host_id',
+    'Host_name': '$host.host_name',
+    'Street': '$address.street',
+    'Country': '$address.country',
+    'Country_code': '$address.country_code',
+    'Location_type': '$address.location.type',
+    'Longitude': {'$arrayElemAt': ['$address.location.coordinates', 0]},
+    'Latitude': {'$arrayElemAt': ['$address.location.coordinates', 1]},
+    'Is_location_exact': '$address.location.is_location_exact',
+    'Availability_365': '$availability.availability_365',
+    'Review_scores': '$review_scores.review_scores_rating',
+}
+AIRBNB_COLUMNS = list(AIRBNB_FIELDS)
+
+
+def airbnb_projection_stage():
+
+    # flattening is done by the server, so reviews, images and every other unused field never leave MongoDB
+    projection = {'_id': 0}
+    projection.update(AIRBNB_FIELDS)
+    return {'$project': projection}
+
+
+def airbnb_pipeline(match=None, first_stages=None):
+
+    # first_stages run before the match, stages such as $geoNear have to open the pipeline
+    pipeline = list(first_stages or [])
+    if match:
+        pipeline.append({'$match': match})
+    pipeline.append(airbnb_projection_stage())
+    return pipeline
+
+
+def airbnb_columns_to_dataframe(columns):
+
+    # casts applied once per column instead of once per document
+    columns['Amenities'] = [', '.join(amenities) if amenities else '' for amenities in columns['Amenities']]
+    airbnb_df = pd.DataFrame(columns, columns=AIRBNB_COLUMNS)
+    airbnb_df['Minimum_nights'] = airbnb_df['Minimum_nights'].astype(int)
+    airbnb_df['Maximum_nights'] = airbnb_df['Maximum_nights'].astype(int)
+    return airbnb_df
+
+
+def empty_airbnb_columns():
+
+    return {column: [] for column in AIRBNB_COLUMNS}
+
+
+def read_airbnb_columns(collection, match=None, batch_size=AIRBNB_BATCH_SIZE, first_stages=None):
+
+    cursor = collection.aggregate(airbnb_pipeline(match, first_stages), batchSize=batch_size)
+
+    # filling column arrays directly, no intermediate dict per listing
+    columns = empty_airbnb_columns()
+    appenders = [(column, columns[column].append) for column in AIRBNB_COLUMNS]
+    for data in cursor:
+        get = data.get
+        for column, append in appenders:
+            append(get(column))
+    return columns
+
+
+def extract_airbnb_data(collection, match=None, batch_size=AIRBNB_BATCH_SIZE, first_stages=None):
+
+    return airbnb_columns_to_dataframe(read_airbnb_columns(collection, match, batch_size, first_stages))
+
+
+def airbnb_partitions(collection, partitions, match=None, partition_by='_id'):
+
+    # disjoint filters that together cover every listing matched by match
+    if partition_by == '_id':
+        # _id ranges of about the same size, the boundaries are read from the _id index by skipping through it
+        listings = collection.count_documents(match or {})
+        boundaries = []
+        for i in range(1, partitions):
+            boundary = list(collection.find(match or {}, {'_id': 1}).sort('_id', 1).skip(i * listings // partitions).limit(1))
+            if boundary and (not boundaries or boundary[0]['_id'] != boundaries[-1]):
+                boundaries.append(boundary[0]['_id'])
+        lower = [None] + boundaries
+        upper = boundaries + [None]
+        filters = [{'_id': dict(([('$gte', low)] if low is not None else []) + ([('$lt', high)] if high is not None else []))} for low, high in zip(lower, upper)]
+        filters = [partition if partition['_id'] else {} for partition in filters]
+    elif partition_by == 'address.country':
+        countries = collection.distinct('address.country', match or {})
+        # listings without a country are read by one more cursor
+        filters = [{'address.country': country} for country in countries] + [{'address.country': {'$nin': countries}}]
+    else:
+        raise ValueError(f"Unsupported partition field : {partition_by}")
+    return [{'$and': [match, partition]} if match else partition for partition in filters]
+
+
+def extract_airbnb_partition(collection, match, batch_size=AIRBNB_BATCH_SIZE):
+
+    return airbnb_columns_to_dataframe(read_airbnb_columns(collection, match, batch_size))
+
+
+def extract_airbnb_partition_process(uri, db_name, collection_name, match, batch_size=AIRBNB_BATCH_SIZE):
+
+    # process workers cannot share the parent's client, each task opens its own connection
+    from pymongo import MongoClient
+    with MongoClient(uri) as client:
+        return extract_airbnb_partition(client[db_name][collection_name], match, batch_size)
+
+
+def extract_airbnb_data_parallel(collection, workers=AIRBNB_EXTRACT_WORKERS, match=None, partition_by='_id', batch_size=AIRBNB_BATCH_SIZE,
+                                 uri=None):
+
+    # one cursor per partition. Threads overlap the server side pipeline and network waits of the cursors (pymongo
+    # releases the GIL on socket reads), with a uri the partitions are read by processes and the python side scales too
+    partitions = airbnb_partitions(collection, workers, match, partition_by)
+    if uri is None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(lambda partition: extract_airbnb_partition(collection, partition, batch_size), partitions))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(extract_airbnb_partition_process, [uri] * len(partitions), [collection.database.name] * len(partitions),
+                                   [collection.name] * len(partitions), partitions, [batch_size] * len(partitions)))
+    # empty partitions would turn integer columns into float when concatenated
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return airbnb_columns_to_dataframe(empty_airbnb_columns())
+    return pd.concat(frames, ignore_index=True)
+
+
+def iter_airbnb_chunks(collection, chunk_size=AIRBNB_CHUNK_SIZE, match=None, batch_size=AIRBNB_BATCH_SIZE):
+
+    # yields dataframes of at most chunk_size listings, only one chunk of raw documents is held at a time
+    cursor = collection.aggregate(airbnb_pipeline(match), batchSize=min(batch_size, chunk_size))
+
+    columns = empty_airbnb_columns()
+    appenders = [(column, columns[column].append) for column in AIRBNB_COLUMNS]
+    rows = 0
+    for data in cursor:
+        get = data.get
+        for column, append in appenders:
+            append(get(column))
+        rows += 1
+        if rows == chunk_size:
+            yield airbnb_columns_to_dataframe(columns)
+            columns = empty_airbnb_columns()
+            appenders = [(column, columns[column].append) for column in AIRBNB_COLUMNS]
+            rows = 0
+
+    if rows:
+        yield airbnb_columns_to_dataframe(columns)
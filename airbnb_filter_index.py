@@ -0,0 +1,68 @@
+from collections import namedtuple
+
+import numpy as np
+
+# row positions of one (Country, Property_type) partition, once ordered by price and once by rating
+FilterPartition = namedtuple('FilterPartition', ['price_order', 'prices', 'rating_order', 'ratings'])
+AirbnbFilterIndex = namedtuple('AirbnbFilterIndex', ['partitions', 'prices', 'ratings', 'countries', 'property_types', 'price_min', 'price_max', 'nbytes'])
+
+
+def build_filter_index(processed_airbnb_df):
+
+    prices = processed_airbnb_df['Price'].to_numpy(dtype=np.float64)
+    ratings = processed_airbnb_df['Review_scores'].to_numpy(dtype=np.float64)
+
+    partitions = {}
+    nbytes = prices.nbytes + ratings.nbytes
+    for key, positions in processed_airbnb_df.groupby(['Country', 'Property_type'], observed=True).indices.items():
+        price_order = positions[np.argsort(prices[positions], kind='stable')]
+        rating_order = positions[np.argsort(ratings[positions], kind='stable')]
+        partition = FilterPartition(price_order, prices[price_order], rating_order, ratings[rating_order])
+        partitions[key] = partition
+        nbytes += sum(array.nbytes for array in partition)
+
+    return AirbnbFilterIndex(partitions, prices, ratings,
+                             sorted(processed_airbnb_df['Country'].unique()),
+                             sorted(processed_airbnb_df['Property_type'].unique()),
+                             processed_airbnb_df['Price'].min(),
+                             processed_airbnb_df['Price'].max(),
+                             nbytes)
+
+
+def range_window(order, values, low, high):
+
+    # binary search for low <= value <= high in an ascending array
+    return order[np.searchsorted(values, low, side='left'):np.searchsorted(values, high, side='right')]
+
+
+def filter_listing_positions(filter_index, country, property_type, price_range, rating_range):
+
+    partition = filter_index.partitions.get((country, property_type))
+    if partition is None:
+        return np.empty(0, dtype=np.intp)
+
+    by_price = range_window(partition.price_order, partition.prices, price_range[0], price_range[1])
+    by_rating = range_window(partition.rating_order, partition.ratings, rating_range[0], rating_range[1])
+    # only the narrower window is checked against the other range, positions are returned in the original row order
+    if len(by_price) <= len(by_rating):
+        window, values, (low, high) = by_price, filter_index.ratings[by_price], rating_range
+    else:
+        window, values, (low, high) = by_rating, filter_index.prices[by_rating], price_range
+    return np.sort(window[(values >= low) & (values <= high)])
+
+
+def filter_listings(processed_airbnb_df, filter_index, country, property_type, price_range, rating_range):
+
+    return processed_airbnb_df.iloc[filter_listing_positions(filter_index, country, property_type, price_range, rating_range)]
+
+
+def filter_listing_mask(processed_airbnb_df, filter_index, country, property_type, price_range, rating_range):
+
+    # same predicates with country and property type optional, a scan of every row used when a search narrows the results anyway
+    mask = (filter_index.prices >= price_range[0]) & (filter_index.prices <= price_range[1])
+    mask &= (filter_index.ratings >= rating_range[0]) & (filter_index.ratings <= rating_range[1])
+    if country is not None:
+        mask &= (processed_airbnb_df['Country'] == country).to_numpy()
+    if property_type is not None:
+        mask &= (processed_airbnb_df['Property_type'] == property_type).to_numpy()
+    return mask
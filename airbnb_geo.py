@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+from pymongo import GEOSPHERE
+
+from airbnb_extraction import AIRBNB_BATCH_SIZE, extract_airbnb_data
+
+GEO_FIELD = 'address.location'
+EARTH_RADIUS_KM = 6378.1
+
+
+def ensure_geo_index(collection):
+
+    # address.location is GeoJSON already, the index makes $geoWithin and $geoNear touch only nearby documents
+    return collection.create_index([(GEO_FIELD, GEOSPHERE)])
+
+
+def listing_match(country=None, property_type=None, price_range=None, rating_range=None):
+
+    # same filters as the Geospatial page, on the raw document fields (ratings are not imputed on the server)
+    match = {}
+    if country is not None:
+        match['address.country'] = country
+    if property_type is not None:
+        match['property_type'] = property_type
+    if price_range is not None:
+        match['price'] = {'$gte': float(price_range[0]), '$lte': float(price_range[1])}
+    if rating_range is not None:
+        match['review_scores.review_scores_rating'] = {'$gte': float(rating_range[0]), '$lte': float(rating_range[1])}
+    return match
+
+
+def bbox_polygon(bbox):
+
+    # bbox is (west, south, east, north) in degrees, edges are geodesics on the server
+    west, south, east, north = bbox
+    return {'type': 'Polygon', 'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]}
+
+
+def geo_pipeline(bbox=None, center=None, radius_km=None, near=None, limit=None, **filters):
+
+    # center and near are (longitude, latitude); near sorts by distance and can be limited by radius_km
+    match = listing_match(**filters)
+    if near is not None:
+        geo_near = {'near': {'type': 'Point', 'coordinates': [float(near[0]), float(near[1])]},
+                    'key': GEO_FIELD,
+                    'distanceField': 'distance_m',
+                    'spherical': True,
+                    'query': match}
+        if radius_km is not None:
+            geo_near['maxDistance'] = float(radius_km) * 1000
+        pipeline = [{'$geoNear': geo_near}]
+    else:
+        if bbox is not None:
+            match[GEO_FIELD] = {'$geoWithin': {'$geometry': bbox_polygon(bbox)}}
+        elif center is not None:
+            match[GEO_FIELD] = {'$geoWithin': {'$centerSphere': [[float(center[0]), float(center[1])], float(radius_km) / EARTH_RADIUS_KM]}}
+        pipeline = [{'$match': match}]
+    if limit is not None:
+        pipeline.append({'$limit': int(limit)})
+    return pipeline
+
+
+def find_geo_listing_ids(collection, batch_size=AIRBNB_BATCH_SIZE, **geo):
+
+    # only ids (and distances for near queries) cross the wire, rows are then taken from the processed data
+    pipeline = geo_pipeline(**geo) + [{'$project': {'_id': 1, 'distance_m': 1}}]
+    listing_ids, distances = [], []
+    for data in collection.aggregate(pipeline, batchSize=batch_size):
+        listing_ids.append(data['_id'])
+        distances.append(data.get('distance_m', np.nan))
+    return pd.DataFrame({'Id': listing_ids, 'Distance_km': np.asarray(distances, dtype=np.float64) / 1000})
+
+
+def find_geo_listings(collection, batch_size=AIRBNB_BATCH_SIZE, **geo):
+
+    # complete extracted rows of the matching documents only
+    return extract_airbnb_data(collection, batch_size=batch_size, first_stages=geo_pipeline(**geo))
+
+
+def build_id_index(processed_airbnb_df):
+
+    return pd.Index(processed_airbnb_df['Id'])
+
+
+def rows_for_geo_ids(processed_airbnb_df, id_index, geo_ids):
+
+    # processed rows of the matched listings in the order of the geo query, with their distance
+    positions = id_index.get_indexer(geo_ids['Id'])
+    found = positions >= 0
+    rows = processed_airbnb_df.iloc[positions[found]].copy()
+    rows['Distance_km'] = geo_ids['Distance_km'].to_numpy()[found]
+    return rows
+
+
+def haversine_km(longitudes, latitudes, longitude, latitude):
+
+    longitudes, latitudes = np.radians(longitudes), np.radians(latitudes)
+    longitude, latitude = np.radians(longitude), np.radians(latitude)
+    a = np.sin((latitudes - latitude) / 2) ** 2 + np.cos(latitudes) * np.cos(latitude) * np.sin((longitudes - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def filter_geo_frame(processed_airbnb_df, bbox=None, center=None, radius_km=None, near=None, limit=None,
+                     country=None, property_type=None, price_range=None, rating_range=None):
+
+    # in-process stand-in for geo_pipeline, same predicates evaluated on the processed data
+    mask = np.ones(len(processed_airbnb_df), dtype=bool)
+    if country is not None:
+        mask &= (processed_airbnb_df['Country'] == country).to_numpy()
+    if property_type is not None:
+        mask &= (processed_airbnb_df['Property_type'] == property_type).to_numpy()
+    if price_range is not None:
+        mask &= processed_airbnb_df['Price'].between(price_range[0], price_range[1]).to_numpy()
+    if rating_range is not None:
+        mask &= processed_airbnb_df['Review_scores'].between(rating_range[0], rating_range[1]).to_numpy()
+
+    longitudes = processed_airbnb_df['Longitude'].to_numpy(dtype=np.float64)
+    latitudes = processed_airbnb_df['Latitude'].to_numpy(dtype=np.float64)
+    distances = np.full(len(processed_airbnb_df), np.nan)
+    if bbox is not None and near is None:
+        west, south, east, north = bbox
+        mask &= (longitudes >= west) & (longitudes <= east) & (latitudes >= south) & (latitudes <= north)
+    elif center is not None or near is not None:
+        origin = near if near is not None else center
+        distances = haversine_km(longitudes, latitudes, origin[0], origin[1])
+        if radius_km is not None:
+            mask &= distances <= radius_km
+
+    positions = np.flatnonzero(mask)
+    if near is not None:
+        positions = positions[np.argsort(distances[positions], kind='stable')]
+    if limit is not None:
+        positions = positions[:int(limit)]
+    return pd.DataFrame({'Id': processed_airbnb_df['Id'].to_numpy()[positions], 'Distance_km': distances[positions]})
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# spans of the last reruns of every session in this process, oldest dropped first
+PERF_MAX_SPANS = 5000
+# frames traced by tracemalloc per allocation, one keeps the tracing overhead low
+PERF_TRACE_FRAMES = 1
+# tracemalloc is process wide and slows every session down, peak memory is traced only when the process is started
+# with this environment variable set (AIRBNB_PERF_TRACE_MEMORY=1 streamlit run airbnb_analysis.py)
+PERF_TRACE_MEMORY_ENV = "AIRBNB_PERF_TRACE_MEMORY"
+
+# one timed stage of a rerun; peak_mb is None unless memory tracing is on
+PerfSpan = namedtuple('PerfSpan', ['rerun', 'session', 'page', 'stage', 'parent', 'started', 'seconds', 'rows', 'peak_mb'])
+
+# every finished span is also logged as one json object, silent unless logging is configured for this logger
+logger = logging.getLogger("airbnb.perf")
+
+_spans = deque(maxlen=PERF_MAX_SPANS)
+_spans_lock = threading.Lock()
+# streamlit runs every session's script in its own thread, the current rerun and open spans are per thread
+_local = threading.local()
+
+
+def begin_rerun(session, page):
+
+    _local.rerun = (f"{session}-{time.time_ns()}", session, page)
+    _local.stack = []
+
+
+def memory_tracing_requested():
+
+    return os.environ.get(PERF_TRACE_MEMORY_ENV, "0") not in ("", "0")
+
+
+def start_memory_tracing():
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(PERF_TRACE_FRAMES)
+
+
+def stop_memory_tracing():
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def memory_tracing():
+
+    return tracemalloc.is_tracing()
+
+
+class SpanTimer:
+
+    # rows is set by the caller inside the with block, the number of rows the stage produced
+    def __init__(self, stage):
+        self.stage = stage
+        self.rows = None
+        self.peak_bytes = 0
+        self.start_bytes = 0
+
+
+@contextmanager
+def perf_span(stage, rows=None):
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    span = SpanTimer(stage)
+    span.rows = rows
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # the traced peak is process wide, it is reset at every span boundary and folded into the enclosing span so
+        # nested spans keep the outer peak right; concurrent sessions add their allocations to it
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].peak_bytes = max(stack[-1].peak_bytes, peak_bytes)
+        tracemalloc.reset_peak()
+        span.start_bytes = span.peak_bytes = current_bytes
+    stack.append(span)
+    started = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        peak_mb = None
+        if tracing and tracemalloc.is_tracing():
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            span.peak_bytes = max(span.peak_bytes, peak_bytes)
+            if stack:
+                stack[-1].peak_bytes = max(stack[-1].peak_bytes, span.peak_bytes)
+            tracemalloc.reset_peak()
+            peak_mb = round((span.peak_bytes - span.start_bytes) / 1024 ** 2, 2)
+        rerun, session, page = getattr(_local, 'rerun', (None, None, None))
+        record_span(PerfSpan(rerun, session, page, stage, stack[-1].stage if stack else None, started.isoformat(),
+                             round(seconds, 6), span.rows, peak_mb))
+
+
+def record_span(span):
+
+    with _spans_lock:
+        _spans.append(span)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(span._asdict()))
+
+
+def recent_spans(session=None):
+
+    with _spans_lock:
+        spans = list(_spans)
+    return [span for span in spans if session is None or span.session == session]
+
+
+def clear_spans():
+
+    with _spans_lock:
+        _spans.clear()
+
+
+def spans_to_jsonl(spans):
+
+    # one json object per line, the format log shippers and pandas.read_json(lines=True) read
+    return "".join(json.dumps(span._asdict()) + "\n" for span in spans)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import folium
+from folium.plugins import FastMarkerCluster
+
+# above this many listings the map shows server side grid clusters instead of one marker per listing
+MAP_MAX_MARKERS = 20000
+
+MAP_POPUP_COLUMNS = ['Name', 'Host_name', 'Price', 'Number_of_reviews', 'Review_scores', 'Total_bedrooms', 'Room_type', 'Accommodates',
+                     'Security_deposit']
+
+# markers and popups are created in the browser from compact rows [lat, lon, name, host, price, ...]
+LISTING_MARKER_CALLBACK = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: 'info-sign', markerColor: 'blue', prefix: 'glyphicon'});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindPopup('<b>' + row[2] + '</b><br>'
+                     + 'Host Name: ' + row[3] + '<br>'
+                     + 'Price: $' + row[4] + '<br>'
+                     + 'Number of Reviews: ' + row[5] + '<br>'
+                     + 'Rating: ' + row[6] + '<br>'
+                     + 'Bedrooms: ' + row[7] + '<br>'
+                     + 'Room Type: ' + row[8] + '<br>'
+                     + 'Accommodates: ' + row[9] + '<br>'
+                     + 'Security Deposit: $' + row[10], {maxWidth: 300});
+    return marker;
+}"""
+
+# rows [lat, lon, listings, average price, min price, max price] of one grid cell
+GRID_CLUSTER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+                                {radius: Math.min(6 + Math.log(row[2]) * 3, 30), color: '#3186cc', fillOpacity: 0.6});
+    marker.bindPopup('<b>' + row[2] + ' listings</b><br>'
+                     + 'Average Price: $' + row[3] + '<br>'
+                     + 'Price Range: $' + row[4] + ' - $' + row[5], {maxWidth: 300});
+    return marker;
+}"""
+
+
+def listing_marker_rows(listings_df):
+
+    # one vectorized string conversion per column instead of an f-string per listing
+    columns = [listings_df['Latitude'].to_numpy(dtype=np.float64), listings_df['Longitude'].to_numpy(dtype=np.float64)]
+    columns += [listings_df[column].astype(str).to_numpy() for column in MAP_POPUP_COLUMNS]
+    return np.column_stack(columns).tolist()
+
+
+def grid_cluster_rows(listings_df, max_cells):
+
+    # bins listings into at most max_cells lat/lon cells, each cell becomes one marker at the centroid of its listings
+    latitudes = listings_df['Latitude'].to_numpy(dtype=np.float64)
+    longitudes = listings_df['Longitude'].to_numpy(dtype=np.float64)
+    cells_per_axis = max(int(np.sqrt(max_cells)), 1)
+    lat_bins = np.floor((latitudes - latitudes.min()) / max(np.ptp(latitudes), 1e-9) * cells_per_axis).clip(0, cells_per_axis - 1)
+    lon_bins = np.floor((longitudes - longitudes.min()) / max(np.ptp(longitudes), 1e-9) * cells_per_axis).clip(0, cells_per_axis - 1)
+
+    cells = pd.DataFrame({'cell': (lat_bins * cells_per_axis + lon_bins).astype(np.int64),
+                          'Latitude': latitudes,
+                          'Longitude': longitudes,
+                          'Price': listings_df['Price'].to_numpy(dtype=np.float64)})
+    clusters = cells.groupby('cell').agg(Latitude=('Latitude', 'mean'),
+                                         Longitude=('Longitude', 'mean'),
+                                         Listings=('Price', 'size'),
+                                         Mean_price=('Price', 'mean'),
+                                         Min_price=('Price', 'min'),
+                                         Max_price=('Price', 'max'))
+    clusters['Mean_price'] = clusters['Mean_price'].round(2)
+    return clusters.to_numpy().tolist()
+
+
+def build_listings_map(listings_df, max_markers=MAP_MAX_MARKERS, zoom_level=1):
+
+    # Create the Folium map, centred on the first listing like before
+    folium_map = folium.Map(
+        location=[float(listings_df['Latitude'].iloc[0]), float(listings_df['Longitude'].iloc[0])],
+        zoom_start=zoom_level,
+        tiles='CartoDB Voyager',
+        control_scale=True
+    )
+
+    if len(listings_df) <= max_markers:
+        FastMarkerCluster(listing_marker_rows(listings_df), callback=LISTING_MARKER_CALLBACK).add_to(folium_map)
+    else:
+        FastMarkerCluster(grid_cluster_rows(listings_df, max_markers), callback=GRID_CLUSTER_CALLBACK).add_to(folium_map)
+    return folium_map
@@ -0,0 +1,272 @@
+import json
+import os
+from collections import Counter
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype, union_categoricals
+
+
+def parse_float(value):
+
+    # Decimal128, str and plain numbers, anything unparsable (None, '') becomes NaN like pd.to_numeric(errors="coerce")
+    try:
+        return float(str(value))
+    except ValueError:
+        return np.nan
+
+
+def to_float64(column):
+
+    if is_numeric_dtype(column.dtype):
+        return column.to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.fromiter(map(parse_float, column.to_numpy()), dtype=np.float64, count=len(column))
+
+
+def convert_decimal(column):
+
+    return pd.Series(to_float64(column), index=column.index, name=column.name)
+
+
+def convert_decimal_int(column):
+
+    return pd.to_numeric(pd.Series(to_float64(column), index=column.index, name=column.name).astype(int), downcast='integer')
+
+
+def convert_int(column):
+
+    return pd.to_numeric(column.astype(int), downcast='integer')
+
+
+def convert_float32(column):
+
+    return pd.Series(to_float64(column), index=column.index, name=column.name).astype(np.float32)
+
+
+def convert_category(column):
+
+    return column.astype('category')
+
+
+def convert_bool(column):
+
+    return column.astype(bool)
+
+
+# column -> conversion, columns not listed here (ids, urls and free text) are kept as they are
+AIRBNB_SCHEMA = {
+    'Property_type': convert_category,
+    'Room_type': convert_category,
+    'Bed_type': convert_category,
+    'Minimum_nights': convert_int,
+    'Maximum_nights': convert_int,
+    'Cancellation_policy': convert_category,
+    'Accommodates': convert_int,
+    'Total_bedrooms': convert_float32,
+    'Total_beds': convert_float32,
+    'Number_of_reviews': convert_int,
+    'Price': convert_decimal,
+    'Security_deposit': convert_decimal,
+    'Cleaning_fee': convert_decimal,
+    'Extra_people': convert_decimal_int,
+    'Guests_included': convert_decimal_int,
+    'Host_name': convert_category,
+    'Country': convert_category,
+    'Country_code': convert_category,
+    'Location_type': convert_category,
+    'Longitude': convert_float32,
+    'Latitude': convert_float32,
+    'Is_location_exact': convert_bool,
+    'Availability_365': convert_int,
+    'Review_scores': convert_float32,
+}
+AIRBNB_CATEGORY_COLUMNS = [column for column, convert in AIRBNB_SCHEMA.items() if convert is convert_category]
+
+
+def convert_airbnb_dtypes(airbnb_data):
+
+    # converting to required datatype in a single pass per column, returns a new frame and leaves airbnb_data untouched
+    return pd.DataFrame({column: AIRBNB_SCHEMA[column](airbnb_data[column]) if column in AIRBNB_SCHEMA else airbnb_data[column]
+                         for column in airbnb_data.columns})
+
+
+def concat_airbnb_frames(frames):
+
+    # chunks have their own categories, without unifying them the concatenated columns fall back to object
+    frames = list(frames)
+    airbnb_data = pd.concat(frames, ignore_index=True)
+    for column in AIRBNB_CATEGORY_COLUMNS:
+        if column in airbnb_data.columns and not isinstance(airbnb_data[column].dtype, pd.CategoricalDtype):
+            airbnb_data[column] = pd.Series(union_categoricals([frame[column].astype('category') for frame in frames], sort_categories=True), index=airbnb_data.index)
+    return airbnb_data
+
+
+def split_airbnb_columns(airbnb_data):
+
+    # one array per column instead of the blocks a frame shares between columns, a column can then be freed on its own
+    return {column: values.copy() for column, values in airbnb_data.items()}
+
+
+def concat_airbnb_columns(chunks):
+
+    # same result as concat_airbnb_frames for chunks from split_airbnb_columns, built one column at a time; every column
+    # is taken out of the chunks as soon as it is copied, so the chunks and the result are never both held in full
+    columns = {}
+    for column in list(chunks[0]) if chunks else []:
+        parts = [chunk.pop(column) for chunk in chunks]
+        same_categories = isinstance(parts[0].dtype, pd.CategoricalDtype) and all(part.dtype == parts[0].dtype for part in parts)
+        if column in AIRBNB_CATEGORY_COLUMNS and not same_categories:
+            columns[column] = pd.Series(union_categoricals([part.astype('category') for part in parts], sort_categories=True))
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+        del parts
+    chunks.clear()
+    return pd.DataFrame(columns, copy=False)
+
+
+def airbnb_memory_usage(airbnb_data):
+
+    # resident size in MB including the python objects behind object columns
+    return airbnb_data.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+# gaps filled with the most frequent value, and with the mean (truncate: cast to int first)
+IMPUTE_MODE_COLUMNS = ['Total_beds', 'Total_bedrooms', 'Review_scores']
+IMPUTE_MEAN_COLUMNS = {'Security_deposit': True, 'Cleaning_fee': False}
+# empty texts are replaced by this placeholder
+IMPUTE_TEXT_COLUMNS = ['Description', 'House_rules', 'Amenities']
+IMPUTER_FORMAT_VERSION = 1
+
+
+def exact_sum(values):
+
+    # every finite float64 is an integer mantissa times a power of two, mantissas are added as integers per exponent so the
+    # sum does not depend on the order or the grouping of the values (float addition does)
+    mantissas, exponents = np.frexp(values[~np.isnan(values)])
+    mantissas = (mantissas * 2.0 ** 53).astype(np.int64)
+    exponent_values, groups = np.unique(exponents, return_inverse=True)
+    # split at bit 27, the int64 group totals can not overflow
+    high_sums = np.zeros(len(exponent_values), dtype=np.int64)
+    low_sums = np.zeros(len(exponent_values), dtype=np.int64)
+    np.add.at(high_sums, groups, mantissas >> 27)
+    np.add.at(low_sums, groups, mantissas & (2 ** 27 - 1))
+    total = Fraction(0)
+    for exponent, high_sum, low_sum in zip(exponent_values.tolist(), high_sums.tolist(), low_sums.tolist()):
+        mantissa_sum = (high_sum << 27) + low_sum
+        shift = exponent - 53
+        total += mantissa_sum << shift if shift >= 0 else Fraction(mantissa_sum, 1 << -shift)
+    return total
+
+
+class AirbnbImputer:
+
+    # gap filling statistics kept as mergeable running totals: value counts for the modes, exact sums and counts for the
+    # means. Statistics of any split of the listings, fitted in any order, merge into exactly the statistics of the whole
+    def __init__(self):
+        self.rows = 0
+        self.value_counts = {column: Counter() for column in IMPUTE_MODE_COLUMNS}
+        self.sums = {column: Fraction(0) for column in IMPUTE_MEAN_COLUMNS}
+        self.counts = {column: 0 for column in IMPUTE_MEAN_COLUMNS}
+
+    def partial_fit(self, airbnb_data, sign=1):
+
+        # sign=-1 takes listings back out, e.g. the previous version of listings that changed
+        self.rows += sign * len(airbnb_data)
+        for column in IMPUTE_MODE_COLUMNS:
+            value_counts = self.value_counts[column]
+            for value, count in airbnb_data[column].value_counts().items():
+                value_counts[float(value)] += sign * int(count)
+                if value_counts[float(value)] == 0:
+                    del value_counts[float(value)]
+        for column in IMPUTE_MEAN_COLUMNS:
+            values = airbnb_data[column].to_numpy(dtype=np.float64, na_value=np.nan)
+            self.sums[column] += sign * exact_sum(values)
+            self.counts[column] += sign * int(np.count_nonzero(~np.isnan(values)))
+        return self
+
+    def fit(self, airbnb_data):
+
+        self.__init__()
+        return self.partial_fit(airbnb_data)
+
+    def remove(self, airbnb_data):
+
+        return self.partial_fit(airbnb_data, sign=-1)
+
+    def merge(self, other):
+
+        self.rows += other.rows
+        for column in IMPUTE_MODE_COLUMNS:
+            value_counts = self.value_counts[column]
+            value_counts.update(other.value_counts[column])
+            for value in [value for value, count in value_counts.items() if count == 0]:
+                del value_counts[value]
+        for column in IMPUTE_MEAN_COLUMNS:
+            self.sums[column] += other.sums[column]
+            self.counts[column] += other.counts[column]
+        return self
+
+    def fill_values(self):
+
+        fill_values = {}
+        for column in IMPUTE_MODE_COLUMNS:
+            if not self.value_counts[column]:
+                raise ValueError(f"no {column} values to impute from")
+            # ties go to the smallest value, whatever order the listings came in
+            fill_values[column] = min(self.value_counts[column].items(), key=lambda item: (-item[1], item[0]))[0]
+        for column, truncate in IMPUTE_MEAN_COLUMNS.items():
+            mean = float(self.sums[column] / self.counts[column]) if self.counts[column] else np.nan
+            fill_values[column] = int(mean) if truncate else mean
+        return fill_values
+
+    def transform(self, airbnb_data):
+
+        # fills airbnb_data in place with the fitted statistics, O(rows of airbnb_data)
+        for column, value in self.fill_values().items():
+            airbnb_data[column] = airbnb_data[column].fillna(value)
+        for column in IMPUTE_TEXT_COLUMNS:
+            airbnb_data[column] = airbnb_data[column].replace(to_replace='', value='NA')
+        return airbnb_data
+
+    def to_dict(self):
+
+        # exact sums are kept as numerator and denominator strings, value counts as [value, count] pairs
+        return {'format_version': IMPUTER_FORMAT_VERSION,
+                'rows': self.rows,
+                'value_counts': {column: [[value, count] for value, count in sorted(value_counts.items())]
+                                 for column, value_counts in self.value_counts.items()},
+                'sums': {column: [str(total.numerator), str(total.denominator)] for column, total in self.sums.items()},
+                'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, state):
+
+        if state.get('format_version') != IMPUTER_FORMAT_VERSION:
+            raise ValueError(f"unsupported imputer format {state.get('format_version')}")
+        imputer = cls()
+        imputer.rows = state['rows']
+        imputer.value_counts = {column: Counter({value: count for value, count in state['value_counts'][column]}) for column in IMPUTE_MODE_COLUMNS}
+        imputer.sums = {column: Fraction(int(state['sums'][column][0]), int(state['sums'][column][1])) for column in IMPUTE_MEAN_COLUMNS}
+        imputer.counts = {column: state['counts'][column] for column in IMPUTE_MEAN_COLUMNS}
+        return imputer
+
+    def save(self, path):
+
+        with open(path + ".tmp", "w") as imputer_file:
+            json.dump(self.to_dict(), imputer_file)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+
+        with open(path) as imputer_file:
+            return cls.from_dict(json.load(imputer_file))
+
+
+def fill_missing_airbnb_data(airbnb_data, imputer=None):
+
+    # updating empty values with relevant data, the statistics come from the complete dataset unless a fitted imputer is given
+    if imputer is None:
+        imputer = AirbnbImputer().fit(airbnb_data)
+    return imputer.transform(airbnb_data)
@@ -0,0 +1,165 @@
+import re
+from array import array
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from pymongo import TEXT
+
+from airbnb_extraction import AIRBNB_BATCH_SIZE
+from airbnb_geo import listing_match
+
+# searched column -> (document field, weight), a match in the name counts as much as three in the description
+SEARCH_FIELDS = {'Name': ('name', 3), 'Description': ('description', 1), 'House_rules': ('house_rules', 1)}
+TEXT_INDEX_NAME = 'airbnb_text'
+# best ranked listings shown, the map and charts only need the top of the ranking
+SEARCH_MAX_RESULTS = 500
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# vocabulary: sorted terms, position = term code
+# indptr, listings, weights: postings of term t are listings[indptr[t]:indptr[t + 1]] with their precomputed bm25 term weight
+SearchIndex = namedtuple('SearchIndex', ['vocabulary', 'indptr', 'listings', 'weights', 'idf', 'rows', 'nbytes'])
+
+
+def tokenize(text):
+
+    # 'NA' is the placeholder preprocessing puts in empty texts
+    if not text or text == 'NA':
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class TermCodes(dict):
+
+    # term -> code in order of first appearance, a new term gets the next code
+    def __missing__(self, term):
+        code = self[term] = len(self)
+        return code
+
+
+def build_search_index(processed_airbnb_df):
+
+    # tokens go straight into int32 code arrays through one term dict, the corpus never exists as python strings at once
+    rows = len(processed_airbnb_df)
+    term_codes = TermCodes()
+    codes, counts = [], []
+    lengths = np.zeros(rows, dtype=np.float64)
+    for column, (field, weight) in SEARCH_FIELDS.items():
+        column_codes = array('i')
+        column_counts = np.zeros(rows, dtype=np.int64)
+        for row, text in enumerate(processed_airbnb_df[column].to_numpy(dtype=object)):
+            tokens = tokenize(text)
+            column_counts[row] = len(tokens)
+            column_codes.extend(map(term_codes.__getitem__, tokens))
+        lengths += weight * column_counts
+        codes.append(np.frombuffer(column_codes, dtype=np.int32))
+        counts.append(column_counts)
+
+    # codes renumbered in sorted term order, the vocabulary is searched with get_indexer
+    terms = np.array(list(term_codes), dtype=object)
+    del term_codes
+    order = np.argsort(terms, kind='stable')
+    sorted_codes = np.empty(len(terms), dtype=np.int64)
+    sorted_codes[order] = np.arange(len(terms))
+    vocabulary = pd.Index(terms[order], dtype=object)
+
+    # one int64 key per token, (term * rows + listing) * fields + field, filled field by field and sorted in place
+    fields = len(SEARCH_FIELDS)
+    keys = np.empty(sum(len(column_codes) for column_codes in codes), dtype=np.int64)
+    start = 0
+    for field_index, (column_codes, column_counts) in enumerate(zip(codes, counts)):
+        column_keys = keys[start:start + len(column_codes)]
+        np.take(sorted_codes, column_codes, out=column_keys)
+        column_keys *= max(rows, 1)
+        column_keys += np.repeat(np.arange(rows, dtype=np.int64), column_counts)
+        column_keys *= fields
+        column_keys += field_index
+        start += len(column_codes)
+    del codes, counts
+    keys.sort()
+
+    # field weighted term frequency of every (term, listing) pair, sorted by term then listing
+    field_weights = np.array([weight for field, weight in SEARCH_FIELDS.values()], dtype=np.float32)
+    token_fields = np.empty(len(keys), dtype=np.uint8)
+    np.remainder(keys, fields, out=token_fields, casting='unsafe')
+    keys //= fields
+    pair_starts = np.empty(len(keys), dtype=bool)
+    pair_starts[:1] = True
+    np.not_equal(keys[1:], keys[:-1], out=pair_starts[1:])
+    pair_starts = np.flatnonzero(pair_starts)
+    term_frequency = np.add.reduceat(field_weights[token_fields], pair_starts, dtype=np.float64) if len(keys) else np.zeros(0)
+    term_codes, listings = np.divmod(keys[pair_starts], max(rows, 1))
+    del keys, token_fields
+
+    # everything but idf depends on the listing only, so it is folded into the postings once
+    document_frequency = np.bincount(term_codes, minlength=len(vocabulary))
+    idf = np.log1p((rows - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+    average_length = max(lengths.mean(), 1.0) if rows else 1.0
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[listings] / average_length)
+    weights = (term_frequency * (BM25_K1 + 1) / (term_frequency + norm)).astype(np.float32)
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(document_frequency, out=indptr[1:])
+    listings = listings.astype(np.int32)
+
+    nbytes = indptr.nbytes + listings.nbytes + weights.nbytes + idf.nbytes + sum(len(term) for term in vocabulary)
+    return SearchIndex(vocabulary, indptr, listings, weights, idf, rows, nbytes)
+
+
+def search_scores(search_index, query, positions=None):
+
+    # bm25 score of every listing (or of the given row positions), listings without any query term score 0
+    scores = np.zeros(search_index.rows, dtype=np.float32)
+    codes = search_index.vocabulary.get_indexer(sorted(set(tokenize(query))))
+    for code in codes[codes >= 0]:
+        start, end = search_index.indptr[code], search_index.indptr[code + 1]
+        # a term has one posting per listing, plain fancy indexing adds it once
+        scores[search_index.listings[start:end]] += search_index.idf[code] * search_index.weights[start:end]
+    return scores if positions is None else scores[positions]
+
+
+def top_scored(filtered_df, scores, limit=SEARCH_MAX_RESULTS):
+
+    # rows of filtered_df with a positive score, best first; scores are aligned with the rows of filtered_df
+    matched = np.flatnonzero(scores > 0)
+    if len(matched) > limit:
+        matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+    order = matched[np.argsort(-scores[matched], kind='stable')]
+    return filtered_df.iloc[order].assign(Score=scores[order])
+
+
+def ensure_text_index(collection):
+
+    # a collection has at most one text index, the same fields and weights as the in-memory index
+    return collection.create_index([(field, TEXT) for field, weight in SEARCH_FIELDS.values()],
+                                   weights={field: weight for field, weight in SEARCH_FIELDS.values()}, name=TEXT_INDEX_NAME)
+
+
+def text_pipeline(query, limit=None, **filters):
+
+    # $text must be in the first $match, the listing filters are evaluated with it on the server
+    match = {'$text': {'$search': query}}
+    match.update(listing_match(**filters))
+    pipeline = [{'$match': match}, {'$sort': {'score': {'$meta': 'textScore'}}}]
+    if limit is not None:
+        pipeline.append({'$limit': int(limit)})
+    return pipeline
+
+
+def find_text_listing_ids(collection, query, limit=None, batch_size=AIRBNB_BATCH_SIZE, **filters):
+
+    # ranked by the server, only ids and scores cross the wire
+    pipeline = text_pipeline(query, limit, **filters) + [{'$project': {'_id': 1, 'score': {'$meta': 'textScore'}}}]
+    listing_ids, scores = [], []
+    for data in collection.aggregate(pipeline, batchSize=batch_size):
+        listing_ids.append(data['_id'])
+        scores.append(data['score'])
+    return pd.DataFrame({'Id': listing_ids, 'Score': np.asarray(scores, dtype=np.float64)})
+
+
+def text_hit_scores(filtered_df, text_ids):
+
+    # server scores aligned with the rows of filtered_df, rows the server did not return score 0
+    return text_ids.set_index('Id')['Score'].reindex(filtered_df['Id']).fillna(0).to_numpy(dtype=np.float32)
@@ -0,0 +1,297 @@
+from collections import Counter, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from airbnb_extraction import iter_airbnb_chunks
+from airbnb_preprocessing import AirbnbImputer, convert_airbnb_dtypes, fill_missing_airbnb_data
+
+HISTOGRAM_COLUMNS = ['Minimum_nights', 'Maximum_nights', 'Accommodates', 'Total_bedrooms', 'Total_beds', 'Number_of_reviews',
+                     'Price', 'Security_deposit', 'Cleaning_fee', 'Extra_people', 'Guests_included', 'Availability_365', 'Review_scores']
+BOXPLOT_COLUMNS = ['Minimum_nights', 'Maximum_nights', 'Accommodates', 'Total_bedrooms', 'Total_beds', 'Availability_365',
+                   'Price', 'Security_deposit', 'Cleaning_fee', 'Extra_people', 'Review_scores']
+HEATMAP_COLUMNS = ['Minimum_nights', 'Maximum_nights', 'Accommodates', 'Total_bedrooms', 'Total_beds', 'Availability_365', 'Number_of_reviews',
+                   'Price', 'Security_deposit', 'Cleaning_fee', 'Extra_people', 'Guests_included', 'Review_scores']
+# column, bars along x or y, palette, title, figure size, ordered by count
+COUNT_PLOTS = [('Country', 'x', 'Paired', "Listing Count For Each Country", (12, 3), True),
+               ('Property_type', 'y', 'Set2', "Listing Count For Each Property Type", (12, 5), True),
+               ('Room_type', 'y', 'Dark2', "Count Of Each Room Type", (12, 2), False),
+               ('Cancellation_policy', 'x', 'pastel', "Count Of Each Cancellation Policy", (12, 2), False),
+               ('Bed_type', 'x', 'Accent', "Count Of Each Bed Type", (12, 3), False)]
+SKETCH_COLUMNS = list(dict.fromkeys(HISTOGRAM_COLUMNS + BOXPLOT_COLUMNS + HEATMAP_COLUMNS))
+EDA_SOURCE_COLUMNS = SKETCH_COLUMNS + [plot[0] for plot in COUNT_PLOTS]
+HISTOGRAM_BINS = 20
+KDE_GRIDSIZE = 200
+KDE_FINE_BINS = 2048
+BOXPLOT_WHIS = 1.5
+# distinct values kept per column before the sketch starts rounding, prices in cents and counts of nights stay far below it
+SKETCH_MAX_VALUES = 100000
+# significant digits kept by the first rounding, one less every time the sketch is still too large
+SKETCH_START_DIGITS = 7
+# processed listings per chunk when streaming, about 50 MB of EDA columns
+EDA_CHUNK_SIZE = 100000
+
+# everything the EDA figures need, computed once per dataset version
+EdaStats = namedtuple('EdaStats', ['histograms', 'boxes', 'counts', 'corr', 'nbytes'])
+Histogram = namedtuple('Histogram', ['counts', 'edges', 'kde_x', 'kde_y'])
+
+
+def round_significant(values, digits):
+
+    magnitude = np.floor(np.log10(np.abs(np.where(values == 0, 1, values))))
+    scale = 10.0 ** (digits - 1 - magnitude)
+    return np.round(values * scale) / scale
+
+
+class ValueSketch:
+
+    # sorted distinct values of a column with their counts. Exact while there are at most max_values of them, which makes
+    # histograms, percentiles and whiskers identical to the ones of the raw column; beyond that values are rounded to fewer
+    # significant digits (relative error below 10 ** (1 - digits)) until they fit. Sketches of any split of a column merge
+    def __init__(self, max_values=SKETCH_MAX_VALUES):
+        self.max_values = max_values
+        self.digits = None
+        self.values = np.empty(0, dtype=np.float64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def update(self, values):
+
+        values = values[~np.isnan(values)]
+        if self.digits is not None:
+            values = round_significant(values, self.digits)
+        distinct, counts = np.unique(values, return_counts=True)
+        return self.add(distinct, counts)
+
+    def merge(self, other):
+
+        distinct, counts = other.values, other.counts
+        if other.digits is not None and (self.digits is None or other.digits < self.digits):
+            self.compact(other.digits)
+        if self.digits is not None and (other.digits is None or other.digits > self.digits):
+            distinct = round_significant(distinct, self.digits)
+        return self.add(distinct, counts)
+
+    def add(self, distinct, counts):
+
+        values, positions = np.unique(np.concatenate([self.values, distinct]), return_inverse=True)
+        self.values = values
+        self.counts = np.bincount(positions, weights=np.concatenate([self.counts, counts]), minlength=len(values)).astype(np.int64)
+        while len(self.values) > self.max_values:
+            self.compact(SKETCH_START_DIGITS if self.digits is None else self.digits - 1)
+        return self
+
+    def compact(self, digits):
+
+        self.digits = digits
+        values, positions = np.unique(round_significant(self.values, digits), return_inverse=True)
+        self.counts = np.bincount(positions, weights=self.counts, minlength=len(values)).astype(np.int64)
+        self.values = values
+
+    @property
+    def n(self):
+
+        return int(self.counts.sum())
+
+    def mean(self):
+
+        return float(np.dot(self.values, self.counts) / self.n) if self.n else np.nan
+
+    def std(self):
+
+        # ddof=1 like numpy's std in the in-memory statistics
+        if self.n < 2:
+            return 0.0
+        return float(np.sqrt(np.dot((self.values - self.mean()) ** 2, self.counts) / (self.n - 1)))
+
+    def percentile(self, q):
+
+        # numpy's default (linear) method reproduced on the counts, virtual index, floor and interpolation as in np.percentile
+        n = self.n
+        quantile = np.true_divide(q, 100)
+        virtual_index = (n - 1) * quantile
+        if virtual_index >= n - 1:
+            return self.values[-1]
+        if virtual_index < 0:
+            return self.values[0]
+        previous_index = np.floor(virtual_index)
+        gamma = virtual_index - previous_index
+        # the value at a 0-based rank is the first distinct value whose cumulative count exceeds it
+        cumulative = np.cumsum(self.counts)
+        below = self.values[np.searchsorted(cumulative, previous_index, side='right')]
+        above = self.values[np.searchsorted(cumulative, previous_index + 1, side='right')]
+        difference = above - below
+        return above - difference * (1 - gamma) if gamma >= 0.5 else below + difference * gamma
+
+    def histogram(self, bins=HISTOGRAM_BINS):
+
+        counts, edges = np.histogram(self.values, bins=bins, weights=self.counts)
+        return counts.astype(np.int64), edges
+
+    def kde_curve(self, edges, gridsize=KDE_GRIDSIZE):
+
+        # gaussian kde with scott's bandwidth on a pre-binned sample, scaled to the histogram counts like seaborn's kde=True
+        n = self.n
+        std = self.std()
+        if n < 2 or std == 0:
+            return np.empty(0), np.empty(0)
+        bandwidth = std * n ** (-1 / 5)
+        low, high = self.values[0], self.values[-1]
+        fine_counts, fine_edges = np.histogram(self.values, bins=KDE_FINE_BINS, range=(low - 3 * bandwidth, high + 3 * bandwidth), weights=self.counts)
+        fine_centres = (fine_edges[:-1] + fine_edges[1:]) / 2
+        kde_x = np.linspace(low, high, gridsize)
+        kernel = np.exp(-0.5 * ((kde_x[:, None] - fine_centres[None, :]) / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+        density = kernel @ fine_counts / n
+        return kde_x, density * n * np.diff(edges).mean()
+
+    def box(self, label, whis=BOXPLOT_WHIS):
+
+        # the dictionary matplotlib's boxplot_stats returns for the raw column, fliers kept once per distinct value
+        stats = {'label': label}
+        if self.n == 0:
+            stats.update(fliers=np.array([]), mean=np.nan, med=np.nan, q1=np.nan, q3=np.nan, iqr=np.nan, cilo=np.nan, cihi=np.nan,
+                         whislo=np.nan, whishi=np.nan)
+            return stats
+        q1, med, q3 = self.percentile(25), self.percentile(50), self.percentile(75)
+        iqr = q3 - q1
+        low_fence, high_fence = q1 - whis * iqr, q3 + whis * iqr
+        inside_high = self.values[self.values <= high_fence]
+        inside_low = self.values[self.values >= low_fence]
+        whishi = q3 if len(inside_high) == 0 or inside_high.max() < q3 else inside_high.max()
+        whislo = q1 if len(inside_low) == 0 or inside_low.min() > q1 else inside_low.min()
+        stats.update(mean=self.mean(), med=med, q1=q1, q3=q3, iqr=iqr,
+                     cilo=med - 1.57 * iqr / np.sqrt(self.n), cihi=med + 1.57 * iqr / np.sqrt(self.n),
+                     whislo=whislo, whishi=whishi,
+                     fliers=self.values[(self.values < whislo) | (self.values > whishi)])
+        return stats
+
+    @property
+    def nbytes(self):
+
+        return self.values.nbytes + self.counts.nbytes
+
+
+class OnlineCovariance:
+
+    # row count, column means and co-moment matrix, chunks are combined with the pairwise update of Chan et al.
+    # rows with a missing value in any column are skipped (preprocessed listings have none in these columns)
+    def __init__(self, columns):
+        self.n = 0
+        self.mean = np.zeros(columns)
+        self.comoment = np.zeros((columns, columns))
+
+    def update(self, matrix):
+
+        matrix = matrix[~np.isnan(matrix).any(axis=1)]
+        if len(matrix) == 0:
+            return self
+        chunk = OnlineCovariance(matrix.shape[1])
+        chunk.n = len(matrix)
+        chunk.mean = matrix.mean(axis=0)
+        centred = matrix - chunk.mean
+        chunk.comoment = centred.T @ centred
+        return self.merge(chunk)
+
+    def merge(self, other):
+
+        n = self.n + other.n
+        if other.n == 0:
+            return self
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * self.n * other.n / n
+        self.mean = self.mean + delta * other.n / n
+        self.n = n
+        return self
+
+    def correlation(self):
+
+        # constant columns give nan like DataFrame.corr
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = np.sqrt(np.diag(self.comoment))
+            return np.clip(self.comoment / np.outer(scale, scale), -1, 1)
+
+
+class EdaSketch:
+
+    # one pass over any number of chunks of processed listings, partial sketches (per chunk, file or process) merge exactly
+    def __init__(self):
+        self.values = {column: ValueSketch() for column in SKETCH_COLUMNS}
+        self.categories = {plot[0]: Counter() for plot in COUNT_PLOTS}
+        self.covariance = OnlineCovariance(len(HEATMAP_COLUMNS))
+
+    def update(self, processed_chunk):
+
+        for column, sketch in self.values.items():
+            sketch.update(processed_chunk[column].to_numpy(dtype=np.float64, na_value=np.nan))
+        for column, counter in self.categories.items():
+            column_counts = processed_chunk[column].value_counts()
+            counter.update({str(label): int(count) for label, count in column_counts[column_counts > 0].items()})
+        self.covariance.update(processed_chunk[HEATMAP_COLUMNS].to_numpy(dtype=np.float64, na_value=np.nan))
+        return self
+
+    def merge(self, other):
+
+        for column, sketch in self.values.items():
+            sketch.merge(other.values[column])
+        for column, counter in self.categories.items():
+            counter.update(other.categories[column])
+        self.covariance.merge(other.covariance)
+        return self
+
+    def eda_stats(self):
+
+        histograms = {}
+        for column in HISTOGRAM_COLUMNS:
+            counts, edges = self.values[column].histogram()
+            histograms[column] = Histogram(counts, edges, *self.values[column].kde_curve(edges))
+        boxes = {column: self.values[column].box(column) for column in BOXPLOT_COLUMNS}
+        counts = {}
+        for column, orient, palette, title, figsize, by_count in COUNT_PLOTS:
+            # most frequent first (ties by label) or in label order, the order of the categories of a processed frame
+            labels = sorted(self.categories[column].items(), key=(lambda item: (-item[1], item[0])) if by_count else (lambda item: item[0]))
+            counts[column] = pd.Series([count for label, count in labels], index=[label for label, count in labels], name='count', dtype=np.int64)
+        corr = pd.DataFrame(self.covariance.correlation(), index=HEATMAP_COLUMNS, columns=HEATMAP_COLUMNS)
+
+        nbytes = sum(array.nbytes for histogram in histograms.values() for array in histogram)
+        nbytes += sum(box['fliers'].nbytes for box in boxes.values())
+        nbytes += sum(column_counts.memory_usage(deep=True) for column_counts in counts.values()) + corr.memory_usage().sum()
+        return EdaStats(histograms, boxes, counts, corr, nbytes)
+
+
+def eda_stats_from_chunks(processed_chunks):
+
+    sketch = EdaSketch()
+    for processed_chunk in processed_chunks:
+        sketch.update(processed_chunk)
+    return sketch.eda_stats()
+
+
+def frame_chunks(processed_airbnb_df, chunk_size=EDA_CHUNK_SIZE):
+
+    for start in range(0, len(processed_airbnb_df), chunk_size):
+        yield processed_airbnb_df.iloc[start:start + chunk_size]
+
+
+def parquet_chunks(path, chunk_size=EDA_CHUNK_SIZE):
+
+    # a processed parquet file or a partitioned directory (the snapshot, airbnb_batch/listings), only the EDA columns are read
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    for batch in dataset.to_batches(columns=[column for column in EDA_SOURCE_COLUMNS if column in dataset.schema.names], batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+def mongo_chunks(collection, imputer, chunk_size=EDA_CHUNK_SIZE):
+
+    # raw listings preprocessed chunk by chunk, the fitted imputer supplies the statistics of the whole collection
+    for chunk in iter_airbnb_chunks(collection, chunk_size=chunk_size):
+        yield fill_missing_airbnb_data(convert_airbnb_dtypes(chunk), imputer)
+
+
+def mongo_eda_stats(collection, imputer=None, chunk_size=EDA_CHUNK_SIZE):
+
+    # the fill values need every listing, without a fitted imputer a first pass over the collection computes them
+    if imputer is None:
+        imputer = AirbnbImputer()
+        for chunk in iter_airbnb_chunks(collection, chunk_size=chunk_size):
+            imputer.partial_fit(convert_airbnb_dtypes(chunk))
+    return eda_stats_from_chunks(mongo_chunks(collection, imputer, chunk_size))
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from airbnb_extraction import extract_airbnb_data
+from airbnb_preprocessing import AirbnbImputer, convert_airbnb_dtypes, fill_missing_airbnb_data, concat_airbnb_frames
+
+# local columnar copy of the listings, so a new session does not need a full collection scan
+SNAPSHOT_DIR = "airbnb_snapshot"
+# bump when the extracted columns or preprocessing change, older snapshots are then ignored
+SNAPSHOT_SCHEMA_VERSION = 3
+# documents with a newer value of this field are fetched again on refresh
+SNAPSHOT_WATERMARK_FIELD = "last_scraped"
+
+MANIFEST_FILE = "manifest.json"
+# extracted data is kept type converted but not imputed, the fill values move as listings are refreshed
+EXTRACTED_FILE = "extracted.parquet"
+PROCESSED_FILE = "processed.parquet"
+# gap filling statistics of the extracted data, a refresh only adds the changed listings to them
+IMPUTER_FILE = "imputer.json"
+
+
+def new_snapshot_version():
+
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+
+
+def encode_watermark(watermark):
+
+    if isinstance(watermark, datetime):
+        return {'type': 'datetime', 'value': watermark.isoformat()}
+    return {'type': 'str', 'value': None if watermark is None else str(watermark)}
+
+
+def decode_watermark(encoded):
+
+    if encoded['value'] is None:
+        return None
+    if encoded['type'] == 'datetime':
+        return datetime.fromisoformat(encoded['value'])
+    return encoded['value']
+
+
+def read_snapshot_manifest(directory=SNAPSHOT_DIR):
+
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('schema_version') != SNAPSHOT_SCHEMA_VERSION:
+        return None
+    return manifest
+
+
+def write_parquet_atomic(airbnb_df, path):
+
+    temp_path = path + ".tmp"
+    airbnb_df.to_parquet(temp_path, engine="pyarrow", index=False)
+    os.replace(temp_path, path)
+
+
+def write_snapshot(extracted_df, directory, watermark_field, watermark, version, created=None, imputer=None):
+
+    # imputer must be fitted on exactly the listings of extracted_df, it is fitted here when not given
+    os.makedirs(directory, exist_ok=True)
+    write_parquet_atomic(extracted_df, os.path.join(directory, EXTRACTED_FILE))
+    if imputer is None:
+        imputer = AirbnbImputer().fit(extracted_df)
+    processed_df = fill_missing_airbnb_data(extracted_df.copy(), imputer)
+    write_parquet_atomic(processed_df, os.path.join(directory, PROCESSED_FILE))
+    imputer.save(os.path.join(directory, IMPUTER_FILE))
+
+    now = datetime.now(timezone.utc).isoformat()
+    manifest = {'schema_version': SNAPSHOT_SCHEMA_VERSION,
+                'version': version,
+                'created': created or now,
+                'refreshed': now,
+                'rows': len(processed_df),
+                'fill_values': imputer.fill_values(),
+                'watermark_field': watermark_field,
+                'watermark': encode_watermark(watermark)}
+    # manifest is written last, a snapshot without one is never loaded
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return processed_df, manifest
+
+
+def load_snapshot(directory=SNAPSHOT_DIR):
+
+    manifest = read_snapshot_manifest(directory)
+    if manifest is None:
+        return None, None
+    processed_df = pd.read_parquet(os.path.join(directory, PROCESSED_FILE), engine="pyarrow", memory_map=True)
+    return processed_df, manifest
+
+
+def load_snapshot_imputer(directory=SNAPSHOT_DIR):
+
+    try:
+        return AirbnbImputer.load(os.path.join(directory, IMPUTER_FILE))
+    except (OSError, ValueError):
+        return None
+
+
+def latest_watermark(collection, watermark_field, match=None):
+
+    latest = list(collection.find(match or {}, {watermark_field: 1}).sort(watermark_field, -1).limit(1))
+    if not latest:
+        return None
+    return latest[0].get(watermark_field)
+
+
+def watermark_match(watermark_field, watermark):
+
+    # listings up to the watermark, and those without a watermark field (null matches a missing field too) that a full
+    # extraction would include; refreshes can not tell when those change, invalidate_snapshot picks them up again
+    if watermark is None:
+        return None
+    return {'$or': [{watermark_field: {'$lte': watermark}}, {watermark_field: None}]}
+
+
+def build_snapshot(collection, directory=SNAPSHOT_DIR, watermark_field=SNAPSHOT_WATERMARK_FIELD):
+
+    watermark = latest_watermark(collection, watermark_field)
+    match = watermark_match(watermark_field, watermark)
+    extracted_df = convert_airbnb_dtypes(extract_airbnb_data(collection, match=match))
+    return write_snapshot(extracted_df, directory, watermark_field, watermark, new_snapshot_version())
+
+
+def refresh_snapshot(collection, directory=SNAPSHOT_DIR, watermark_field=SNAPSHOT_WATERMARK_FIELD):
+
+    # returns the processed data, its manifest and the number of new or changed listings
+    manifest = read_snapshot_manifest(directory)
+    if manifest is None or manifest['watermark_field'] != watermark_field:
+        processed_df, manifest = build_snapshot(collection, directory, watermark_field)
+        return processed_df, manifest, manifest['rows']
+
+    previous_watermark = decode_watermark(manifest['watermark'])
+    if previous_watermark is None:
+        processed_df, manifest = build_snapshot(collection, directory, watermark_field)
+        return processed_df, manifest, manifest['rows']
+
+    # the watermark is not unique, listings written after the last refresh can carry the same value as the stored one:
+    # listings at the stored watermark are fetched again and replace their copy like any changed listing
+    watermark = latest_watermark(collection, watermark_field, {watermark_field: {'$gte': previous_watermark}})
+    changed_df = None
+    if watermark is not None:
+        changed_df = convert_airbnb_dtypes(extract_airbnb_data(collection, match={watermark_field: {'$gte': previous_watermark, '$lte': watermark}}))
+        changed_df = changed_df.drop_duplicates('Id', keep='last')
+    if changed_df is None or changed_df.empty:
+        processed_df, manifest = load_snapshot(directory)
+        return processed_df, manifest, 0
+
+    extracted_df = pd.read_parquet(os.path.join(directory, EXTRACTED_FILE), engine="pyarrow", memory_map=True)
+    # changed listings replace their previous version, deleted listings need invalidate_snapshot
+    replaced = extracted_df['Id'].isin(changed_df['Id'])
+    # the statistics are updated with the changed listings only, without a rescan of the unchanged ones
+    imputer = load_snapshot_imputer(directory)
+    if imputer is not None:
+        imputer.remove(extracted_df[replaced]).partial_fit(changed_df)
+    extracted_df = concat_airbnb_frames([extracted_df[~replaced], changed_df])
+    processed_df, manifest = write_snapshot(extracted_df, directory, watermark_field, watermark, new_snapshot_version(), manifest['created'], imputer)
+    return processed_df, manifest, len(changed_df)
+
+
+def invalidate_snapshot(directory=SNAPSHOT_DIR):
+
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from pymongo import MongoClient
+
+from airbnb_extraction import MONGO_URI, AIRBNB_DB, AIRBNB_COLLECTION, AIRBNB_BATCH_SIZE, extract_airbnb_data
+
+
+def legacy_extract(collection):
+
+    # extraction as it was before the projected pipeline: full documents and one dict per listing
+    airbnb_required_data = []
+    for data in collection.find():
+        dict_data = dict(Id = data['_id'],
+                         Listing_url = data['listing_url'],
+                         Name = data.get('name'),
+                         Description = data['description'],
+                         House_rules = data.get('house_rules'),
+                         Property_type = data['property_type'],
+                         Room_type = data['room_type'],
+                         Bed_type = data['bed_type'],
+                         Minimum_nights = int(data['minimum_nights']),
+                         Maximum_nights = int(data['maximum_nights']),
+                         Cancellation_policy = data['cancellation_policy'],
+                         Accommodates = data['accommodates'],
+                         Total_bedrooms = data.get('bedrooms'),
+                         Total_beds = data.get('beds'),
+                         Number_of_reviews = data['number_of_reviews'],
+                         Amenities = ', '.join(data['amenities']),
+                         Price = data['price'],
+                         Security_deposit = data.get('security_deposit'),
+                         Cleaning_fee = data.get('cleaning_fee'),
+                         Extra_people = data['extra_people'],
+                         Guests_included= data['guests_included'],
+                         Host_id = data['host']['host_id'],
+                         Host_name = data['host']['host_name'],
+                         Street = data['address']['street'],
+                         Country = data['address']['country'],
+                         Country_code = data['address']['country_code'],
+                         Location_type = data['address']['location']['type'],
+                         Longitude = data['address']['location']['coordinates'][0],
+                         Latitude = data['address']['location']['coordinates'][1],
+                         Is_location_exact = data['address']['location']['is_location_exact'],
+                         Availability_365 = data['availability']['availability_365'],
+                         Review_scores = data['review_scores'].get('review_scores_rating'))
+        airbnb_required_data.append(dict_data)
+    return pd.DataFrame(airbnb_required_data)
+
+
+def server_bytes_out(client):
+
+    return client.admin.command('serverStatus')['network']['bytesOut']
+
+
+def run_mode(mode, uri, db_name, collection_name, batch_size):
+
+    client = MongoClient(uri)
+    collection = client[db_name][collection_name]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    bytes_before = server_bytes_out(client)
+    start = time.perf_counter()
+    if mode == 'legacy':
+        airbnb_df = legacy_extract(collection)
+    else:
+        airbnb_df = extract_airbnb_data(collection, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    # serverStatus counts every connection, so this is only accurate on an otherwise idle mongod
+    wire_bytes = server_bytes_out(client) - bytes_before
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'mode': mode,
+            'rows': len(airbnb_df),
+            'seconds': round(elapsed, 3),
+            'wire_mb': round(wire_bytes / 1024 ** 2, 2),
+            'peak_rss_mb': round(rss_peak / 1024, 1),
+            'rss_growth_mb': round((rss_peak - rss_before) / 1024, 1),
+            'frame_mb': round(airbnb_df.memory_usage(deep=True).sum() / 1024 ** 2, 2)}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare legacy and projected MongoDB extraction (time, wire bytes, RSS)")
+    parser.add_argument('--uri', default=MONGO_URI)
+    parser.add_argument('--db', default=AIRBNB_DB)
+    parser.add_argument('--collection', default=AIRBNB_COLLECTION)
+    parser.add_argument('--batch-size', type=int, default=AIRBNB_BATCH_SIZE)
+    parser.add_argument('--mode', choices=['legacy', 'projected', 'both'], default='both')
+    args = parser.parse_args()
+
+    if args.mode != 'both':
+        print(json.dumps(run_mode(args.mode, args.uri, args.db, args.collection, args.batch_size)))
+        return
+
+    # each mode runs in a fresh interpreter so peak RSS of one does not hide the other
+    results = []
+    for mode in ('legacy', 'projected'):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--uri', args.uri, '--db', args.db,
+                                 '--collection', args.collection, '--batch-size', str(args.batch_size)],
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(pd.DataFrame(results).set_index('mode').to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import folium
+from folium.plugins import MarkerCluster
+
+from airbnb_map import MAP_MAX_MARKERS, build_listings_map
+
+
+def synthetic_listings(points, seed=0):
+
+    # only the columns the map reads, spread around a few city centres
+    rng = np.random.default_rng(seed)
+    centres = np.array([[41.39, 2.17], [-22.97, -43.19], [40.71, -74.0], [22.28, 114.16], [-33.87, 151.21]])
+    centre = centres[rng.integers(0, len(centres), points)]
+    return pd.DataFrame({'Name': [f'Listing {i}' for i in range(points)],
+                         'Host_name': pd.Categorical([f'Host {i}' for i in rng.integers(0, max(points // 5, 1), points)]),
+                         'Price': rng.integers(20, 1000, points).astype(float),
+                         'Number_of_reviews': rng.integers(0, 400, points),
+                         'Review_scores': rng.integers(20, 101, points).astype(np.float32),
+                         'Total_bedrooms': rng.integers(0, 6, points).astype(np.float32),
+                         'Room_type': pd.Categorical(rng.choice(['Entire home/apt', 'Private room', 'Shared room'], points)),
+                         'Accommodates': rng.integers(1, 16, points),
+                         'Security_deposit': rng.integers(0, 500, points).astype(float),
+                         'Latitude': (centre[:, 0] + rng.normal(0, 0.2, points)).astype(np.float32),
+                         'Longitude': (centre[:, 1] + rng.normal(0, 0.2, points)).astype(np.float32)})
+
+
+def legacy_listings_map(country_df):
+
+    # map construction as it was before the bulk layer: one Popup and one Marker per listing
+    names = country_df['Name'].values
+    reviews = country_df['Number_of_reviews'].values
+    ratings = country_df['Review_scores'].values
+    price = country_df['Price'].values
+    bedrooms = country_df['Total_bedrooms'].values
+    room_type = country_df['Room_type'].values
+    accommodates = country_df['Accommodates'].values
+    security_deposit = country_df['Security_deposit'].values
+    host_name = country_df['Host_name'].values
+    latitudes = country_df['Latitude'].values
+    longitudes = country_df['Longitude'].values
+
+    folium_map = folium.Map(location=[latitudes[0], longitudes[0]], zoom_start=1, tiles='CartoDB Voyager', control_scale=True)
+    marker_cluster = MarkerCluster().add_to(folium_map)
+    for i in range(len(names)):
+        popup_content = (f'<b>{names[i]}</b><br>'
+                         f'Host Name: {host_name[i]}<br>'
+                         f'Price: ${price[i]}<br>'
+                         f'Number of Reviews: {reviews[i]}<br>'
+                         f'Rating: {ratings[i]}<br>'
+                         f'Bedrooms: {bedrooms[i]}<br>'
+                         f'Room Type: {room_type[i]}<br>'
+                         f'Accommodates: {accommodates[i]}<br>'
+                         f'Security Deposit: ${security_deposit[i]}')
+        popup = folium.Popup(popup_content, max_width=300)
+        folium.Marker(location=[latitudes[i], longitudes[i]], popup=popup, icon=folium.Icon(color='blue', icon='info-sign')).add_to(marker_cluster)
+    return folium_map
+
+
+def measure(builder, listings_df):
+
+    # build plus render, st_folium needs the full html of the map
+    start = time.perf_counter()
+    folium_map = builder(listings_df)
+    html = folium_map.get_root().render()
+    return time.perf_counter() - start, len(html.encode('utf-8'))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Folium map build time and html size against point count")
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 5000, 20000, 100000, 500000])
+    parser.add_argument('--legacy-max', type=int, default=20000, help="skip the per-marker map above this many points")
+    parser.add_argument('--max-markers', type=int, default=MAP_MAX_MARKERS)
+    args = parser.parse_args()
+
+    results = []
+    for points in args.points:
+        listings_df = synthetic_listings(points)
+        seconds, size = measure(lambda df: build_listings_map(df, max_markers=args.max_markers), listings_df)
+        results.append({'points': points, 'mode': 'bulk' if points <= args.max_markers else 'grid clusters',
+                        'seconds': round(seconds, 3), 'html_mb': round(size / 1024 ** 2, 2)})
+        if points <= args.legacy_max:
+            seconds, size = measure(legacy_listings_map, listings_df)
+            results.append({'points': points, 'mode': 'legacy markers', 'seconds': round(seconds, 3), 'html_mb': round(size / 1024 ** 2, 2)})
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from pymongo import MongoClient
+
+from airbnb_extraction import MONGO_URI, AIRBNB_BATCH_SIZE, extract_airbnb_data, extract_airbnb_data_parallel
+from synthetic_airbnb import load_synthetic_listings
+
+BENCHMARK_DB = "airbnb_benchmark"
+BENCHMARK_COLLECTION = "listingsAndReviews"
+
+
+def measure(extract, repeat):
+
+    # best of repeat runs, the first run also warms the mongod cache
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(extract())
+        timings.append(time.perf_counter() - start)
+    return rows, min(timings)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Serial vs partitioned parallel extraction throughput against a local mongod")
+    parser.add_argument('--uri', default=MONGO_URI)
+    parser.add_argument('--db', default=BENCHMARK_DB)
+    parser.add_argument('--collection', default=BENCHMARK_COLLECTION)
+    parser.add_argument('--load', type=int, default=None, help="replace the collection with this many synthetic listings first")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--partition-by', choices=['_id', 'address.country'], default='_id')
+    parser.add_argument('--executor', choices=['thread', 'process', 'both'], default='both')
+    parser.add_argument('--batch-size', type=int, default=AIRBNB_BATCH_SIZE)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    collection = MongoClient(args.uri)[args.db][args.collection]
+    if args.load:
+        print(f"loaded {load_synthetic_listings(collection, args.load)} synthetic listings into {args.db}.{args.collection}")
+
+    rows, serial_seconds = measure(lambda: extract_airbnb_data(collection, batch_size=args.batch_size), args.repeat)
+    results = [{'executor': 'serial', 'workers': 1, 'rows': rows, 'seconds': round(serial_seconds, 3),
+                'rows_per_s': int(rows / serial_seconds), 'speedup': 1.0}]
+    executors = ['thread', 'process'] if args.executor == 'both' else [args.executor]
+    for executor in executors:
+        for workers in args.workers:
+            uri = args.uri if executor == 'process' else None
+            rows, seconds = measure(lambda: extract_airbnb_data_parallel(collection, workers, partition_by=args.partition_by,
+                                                                         batch_size=args.batch_size, uri=uri), args.repeat)
+            results.append({'executor': executor, 'workers': workers, 'rows': rows, 'seconds': round(seconds, 3),
+                            'rows_per_s': int(rows / seconds), 'speedup': round(serial_seconds / seconds, 2)})
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
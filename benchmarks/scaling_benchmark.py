@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from airbnb_extraction import AIRBNB_COLUMNS, read_airbnb_columns, airbnb_columns_to_dataframe, empty_airbnb_columns
+from airbnb_preprocessing import convert_airbnb_dtypes, fill_missing_airbnb_data
+from airbnb_aggregates import build_airbnb_cube, filter_processed_airbnb_df
+from airbnb_filter_index import build_filter_index, filter_listings
+from airbnb_geo import filter_geo_frame
+from airbnb_map import build_listings_map
+from airbnb_amenities import build_amenity_index, amenity_positions
+from airbnb_search import build_search_index, search_scores, top_scored
+from airbnb_sketches import eda_stats_from_chunks, parquet_chunks
+from synthetic_airbnb import COUNTRIES, synthetic_listing_batches, project_listing_document
+
+SIZES = [10000, 100000, 1000000, 5000000]
+# random country / property type / price / rating selections timed on the Geospatial filters, the median is reported
+GEO_QUERIES = 20
+# must have filter timed against the amenity index
+AMENITY_QUERY = ['Wifi', 'Kitchen', 'Pool']
+# keyword search ranked over every listing
+SEARCH_QUERY = "sea view"
+
+
+class StageMeter:
+
+    # wall time of the timed sections. When tracing, memory is traced only inside the timed sections (data generation
+    # stays untraced): peak is the most memory the stage had allocated at once above its start, retained what it keeps
+    def __init__(self, name, trace=False):
+        self.name = name
+        self.trace = trace
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        self.retained_bytes = 0
+
+    def timed(self, function, *args, **kwargs):
+        if self.trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.seconds += time.perf_counter() - start
+        if self.trace:
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.peak_bytes = max(self.peak_bytes, self.retained_bytes + peak_bytes)
+            self.retained_bytes += current_bytes
+        return result
+
+    def finish(self, rows, output_rows=None):
+        result = {'rows': rows, 'stage': self.name, 'seconds': round(self.seconds, 4),
+                  'output_rows': len(output_rows) if hasattr(output_rows, '__len__') else output_rows}
+        if self.trace:
+            result['peak_mb'] = round(self.peak_bytes / 1024 ** 2, 1)
+            result['retained_mb'] = round(self.retained_bytes / 1024 ** 2, 1)
+        return result
+
+
+class ProjectedDocuments:
+
+    # stands in for the collection, aggregate returns the documents as the server would after airbnb_projection_stage
+    def __init__(self, documents):
+        self.documents = documents
+
+    def aggregate(self, pipeline, batchSize=None):
+        return iter(self.documents)
+
+
+def flatten_documents(rows, seed, meter):
+
+    # documents are generated and projected outside the timed sections, one batch at a time
+    columns = empty_airbnb_columns()
+    for documents in synthetic_listing_batches(rows, seed):
+        projected = ProjectedDocuments([project_listing_document(document) for document in documents])
+        batch_columns = meter.timed(read_airbnb_columns, projected)
+        meter.timed(lambda: [columns[column].extend(batch_columns[column]) for column in AIRBNB_COLUMNS])
+    return meter.timed(airbnb_columns_to_dataframe, columns)
+
+
+def geo_queries(processed_df, seed):
+
+    rng = np.random.default_rng(seed)
+    keys = processed_df.groupby(['Country', 'Property_type'], observed=True).size()
+    keys = keys[keys > 0].index.tolist()
+    price_min, price_max = processed_df['Price'].min(), processed_df['Price'].max()
+    queries = []
+    for _ in range(GEO_QUERIES):
+        country, property_type = keys[rng.integers(len(keys))]
+        low_price, high_price = sorted(rng.uniform(price_min, price_max, 2))
+        low_rating = int(rng.integers(0, 90))
+        queries.append((country, property_type, (low_price, high_price), (low_rating, 100)))
+    return queries
+
+
+def run_size(rows, seed, trace=False):
+
+    results = []
+
+    meter = StageMeter('flatten documents', trace)
+    extracted_df = flatten_documents(rows, seed, meter)
+    results.append(meter.finish(rows, extracted_df))
+
+    # the two steps of preprocess_airbnb_data, without the streamlit error reporting around them
+    meter = StageMeter('preprocess: convert dtypes', trace)
+    processed_df = meter.timed(convert_airbnb_dtypes, extracted_df)
+    results.append(meter.finish(rows, processed_df))
+    del extracted_df
+
+    meter = StageMeter('preprocess: fill missing', trace)
+    processed_df = meter.timed(fill_missing_airbnb_data, processed_df)
+    results.append(meter.finish(rows, processed_df))
+    frame_mb = processed_df.memory_usage(deep=True).sum() / 1024 ** 2
+
+    meter = StageMeter('aggregates: cube', trace)
+    cube = meter.timed(build_airbnb_cube, processed_df)
+    results.append(meter.finish(rows, cube))
+
+    meter = StageMeter('aggregates: filter_processed_airbnb_df', trace)
+    tables = meter.timed(filter_processed_airbnb_df, processed_df, cube)
+    results.append(meter.finish(rows, sum(len(table) for table in tables)))
+
+    meter = StageMeter('geospatial: filter index', trace)
+    filter_index = meter.timed(build_filter_index, processed_df)
+    results.append(meter.finish(rows, len(filter_index.partitions)))
+
+    # per query latency, so the figure is comparable whatever GEO_QUERIES is
+    meter = StageMeter('geospatial: filter query (median)', trace)
+    latencies, matched = [], []
+    for query in geo_queries(processed_df, seed):
+        elapsed = meter.seconds
+        matched.append(len(meter.timed(filter_listings, processed_df, filter_index, *query)))
+        latencies.append(meter.seconds - elapsed)
+    meter.seconds = float(np.median(latencies))
+    results.append(meter.finish(rows, int(np.median(matched))))
+
+    meter = StageMeter('amenities: index', trace)
+    amenity_index = meter.timed(build_amenity_index, processed_df)
+    results.append(meter.finish(rows, len(amenity_index.vocabulary)))
+
+    meter = StageMeter('amenities: must have query', trace)
+    results.append(meter.finish(rows, meter.timed(amenity_positions, amenity_index, AMENITY_QUERY)))
+
+    meter = StageMeter('search: index', trace)
+    search_index = meter.timed(build_search_index, processed_df)
+    results.append(meter.finish(rows, len(search_index.vocabulary)))
+
+    meter = StageMeter('search: ranked query', trace)
+    results.append(meter.finish(rows, meter.timed(lambda: top_scored(processed_df, search_scores(search_index, SEARCH_QUERY)))))
+    del search_index
+
+    meter = StageMeter('eda: statistics', trace)
+    results.append(meter.finish(rows, len(meter.timed(eda_stats_from_chunks, [processed_df]).histograms)))
+
+    # the same statistics streamed from a parquet file chunk by chunk, the file is written outside the timed section
+    with tempfile.TemporaryDirectory() as temp_dir:
+        parquet_path = os.path.join(temp_dir, 'processed.parquet')
+        processed_df.to_parquet(parquet_path, engine="pyarrow", index=False)
+        meter = StageMeter('eda: statistics streamed from parquet', trace)
+        results.append(meter.finish(rows, len(meter.timed(lambda: eda_stats_from_chunks(parquet_chunks(parquet_path))).histograms)))
+
+    longitude, latitude = COUNTRIES[0][2]
+    meter = StageMeter('geospatial: 10 km distance filter', trace)
+    geo_ids = meter.timed(filter_geo_frame, processed_df, near=(longitude, latitude), radius_km=10)
+    results.append(meter.finish(rows, geo_ids))
+
+    # the largest selection the page can show: the biggest country and property type over the full price and rating range
+    country, property_type = processed_df.groupby(['Country', 'Property_type'], observed=True).size().idxmax()
+    map_df = filter_listings(processed_df, filter_index, country, property_type,
+                             (processed_df['Price'].min(), processed_df['Price'].max()), (0, 100))
+    meter = StageMeter('map: build and render html', trace)
+    html = meter.timed(lambda: build_listings_map(map_df).get_root().render())
+    results.append(meter.finish(rows, map_df))
+    results[-1]['html_mb'] = round(len(html.encode('utf-8')) / 1024 ** 2, 2)
+
+    for result in results:
+        result['frame_mb'] = round(frame_mb, 1)
+    return results
+
+
+def environment():
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(results, baseline_path, tolerance):
+
+    # stages slower than the baseline by more than tolerance at the same row count
+    with open(baseline_path) as baseline_file:
+        baseline = pd.DataFrame(json.load(baseline_file)['results'])
+    merged = pd.DataFrame(results).merge(baseline, on=['rows', 'stage'], suffixes=('', '_baseline'))
+    # sub millisecond timings are mostly noise, they are compared as one millisecond
+    merged['time_ratio'] = (merged['seconds'].clip(lower=1e-3) / merged['seconds_baseline'].clip(lower=1e-3)).round(2)
+    merged['regression'] = merged['time_ratio'] > tolerance
+    columns = ['rows', 'stage', 'seconds_baseline', 'seconds', 'time_ratio']
+    if 'peak_mb' in merged and 'peak_mb_baseline' in merged:
+        # allocations below a megabyte are noise, they are compared as one megabyte
+        merged['memory_ratio'] = (merged['peak_mb'].clip(lower=1) / merged['peak_mb_baseline'].clip(lower=1)).round(2)
+        merged['regression'] |= merged['memory_ratio'] > tolerance
+        columns += ['peak_mb_baseline', 'peak_mb', 'memory_ratio']
+    return merged[columns + ['regression']]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Time and peak memory of each stage of the app against row count, offline on synthetic listings")
+    parser.add_argument('--rows', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the report as json, to be used as a --compare baseline later")
+    parser.add_argument('--compare', help="json report of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="time or memory ratio above which a stage counts as a regression")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass, timings only")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--trace', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_size(args.child, args.seed, args.trace)))
+        return
+
+    # every row count runs in a fresh interpreter; tracemalloc slows allocation heavy code down, so timings come from
+    # an untraced run and memory from a second, traced run of the same stages on the same data
+    results = []
+    for rows in args.rows:
+        runs = []
+        for trace in ([False] if args.no_memory else [False, True]):
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(rows), '--seed', str(args.seed)] +
+                                   (['--trace'] if trace else []), capture_output=True, text=True)
+            if child.returncode != 0:
+                print(f"{rows} rows failed:\n{child.stderr[-2000:]}")
+                break
+            runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+        else:
+            for timed, traced in zip(runs[0], runs[-1]):
+                timed.update({key: traced[key] for key in ('peak_mb', 'retained_mb') if key in traced})
+            results += runs[0]
+
+    report = pd.DataFrame(results)
+    for value in ['seconds', 'peak_mb']:
+        if value in report:
+            print(f"{value} by stage and row count")
+            print(report.pivot(index='stage', columns='rows', values=value).reindex(report['stage'].unique()).to_string())
+            print()
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'environment': environment(), 'results': results}, output_file, indent=2)
+
+    if args.compare:
+        comparison = compare(results, args.compare, args.tolerance)
+        print(comparison.to_string(index=False))
+        if comparison['regression'].any():
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGES = ['Data Preparation', 'Exploratory Data Analysis (EDA)', 'Geospatial Visualization', 'Advanced Analysis', 'Performance']
+# libraries that are expensive to import, only the pages that use them should load them
+HEAVY_LIBRARIES = ['pymongo', 'plotly', 'folium', 'streamlit_folium', 'matplotlib', 'seaborn']
+
+
+def is_heavy(name):
+
+    return any(name == library or name.startswith(library + '.') for library in HEAVY_LIBRARIES)
+
+
+def heavy_import_seconds(importtime_log):
+
+    # cumulative import time of the heavy libraries from "python -X importtime", entries nested inside another heavy
+    # library are already part of its cumulative time and are not counted twice
+    pending = []
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        children = [entry for entry in pending if entry[0] > depth]
+        pending = [entry for entry in pending if entry[0] <= depth]
+        if is_heavy(name.strip()):
+            pending.append((depth, int(cumulative_us)))
+        else:
+            pending += [(depth + 0.5, cumulative_us) for _, cumulative_us in children]
+    return sum(cumulative_us for _, cumulative_us in pending) / 1e6
+
+
+def run_page(page):
+
+    # runs in a fresh interpreter: streamlit itself is imported first, then the app script is run once cold and once warm
+    from streamlit.testing.v1 import AppTest
+
+    # the sidebar menu is a browser component that needs a running server, a stand-in module returns the page to show
+    menu = types.ModuleType('streamlit_option_menu')
+    menu.option_menu = lambda *args, **kwargs: page
+    sys.modules['streamlit_option_menu'] = menu
+    start = time.perf_counter()
+    app = AppTest.from_file(os.path.join(ROOT, 'airbnb_analysis.py'), default_timeout=600)
+    app.run()
+    first_paint = time.perf_counter() - start
+
+    start = time.perf_counter()
+    app.run()
+    rerun = time.perf_counter() - start
+
+    loaded = sorted(library for library in HEAVY_LIBRARIES if library in sys.modules)
+    return {'first_paint_s': first_paint, 'rerun_s': rerun, 'libraries': loaded, 'exception': bool(app.exception)}
+
+
+def measure(page):
+
+    child = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child', page],
+                           cwd=ROOT, capture_output=True, text=True, check=True)
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    result['library_import_s'] = heavy_import_seconds(child.stderr)
+    return result
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Cold import time and time to first paint of each page, each in a fresh interpreter")
+    parser.add_argument('--pages', nargs='+', default=PAGES)
+    parser.add_argument('--repeat', type=int, default=3, help="fresh interpreters per page, the median is reported")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_page(args.child)))
+        return
+
+    import pandas as pd
+
+    results = []
+    for page in args.pages:
+        runs = pd.DataFrame([measure(page) for _ in range(args.repeat)])
+        results.append({'page': page,
+                        'library_import_s': round(runs['library_import_s'].median(), 3),
+                        'first_paint_s': round(runs['first_paint_s'].median(), 3),
+                        'rerun_s': round(runs['rerun_s'].median(), 3),
+                        'libraries': ', '.join(runs['libraries'].iloc[0]) or '-',
+                        'errors': int(runs['exception'].sum())})
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import os
+import sys
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from bson import Decimal128
+
+from airbnb_extraction import AIRBNB_FIELDS
+
+# country, country code, city centre (longitude, latitude) and share of listings, close to sample_airbnb
+COUNTRIES = [('United States', 'US', (-155.5, 19.6), 0.24), ('Turkey', 'TR', (28.98, 41.01), 0.12), ('Canada', 'CA', (-73.57, 45.5), 0.12),
+             ('Hong Kong', 'HK', (114.16, 22.28), 0.11), ('Portugal', 'PT', (-8.61, 41.15), 0.10), ('Brazil', 'BR', (-43.19, -22.97), 0.09),
+             ('Spain', 'ES', (2.17, 41.39), 0.11), ('Australia', 'AU', (151.21, -33.87), 0.11), ('China', 'CN', (114.06, 22.54), 0.004)]
+PROPERTY_TYPES = ['Apartment', 'House', 'Condominium', 'Serviced apartment', 'Loft', 'Townhouse', 'Guest suite', 'Bed and breakfast',
+                  'Guesthouse', 'Hostel', 'Villa', 'Hotel', 'Boutique hotel', 'Cottage', 'Aparthotel', 'Bungalow', 'Cabin', 'Other',
+                  'Tiny house', 'Chalet', 'Earth house', 'Resort', 'Nature lodge', 'Camper/RV', 'Farm stay', 'Boat', 'Casa particular',
+                  'Barn', 'Heritage hotel (India)', 'Castle', 'Treehouse', 'Houseboat', 'Pension (South Korea)', 'Campsite', 'Hut', 'Train']
+ROOM_TYPES = ['Entire home/apt', 'Private room', 'Shared room']
+BED_TYPES = ['Real Bed', 'Pull-out Sofa', 'Futon', 'Couch', 'Airbed']
+CANCELLATION_POLICIES = ['strict_14_with_grace_period', 'flexible', 'moderate', 'super_strict_60', 'super_strict_30']
+AMENITIES = ['Wifi', 'Kitchen', 'Essentials', 'Hangers', 'Hair dryer', 'Iron', 'TV', 'Shampoo', 'Heating', 'Washer', 'Air conditioning',
+             'Smoke detector', 'Laptop friendly workspace', 'Hot water', 'Refrigerator', 'Dishes and silverware', 'Microwave', 'Elevator',
+             'Cooking basics', 'Stove', 'Bed linens', 'Oven', 'Internet', 'Family/kid friendly', 'Coffee maker', 'First aid kit',
+             'Fire extinguisher', 'Carbon monoxide detector', 'Free parking on premises', 'Cable TV', 'Long term stays allowed',
+             'Dishwasher', 'Extra pillows and blankets', 'Lock on bedroom door', 'Private entrance', 'Self check-in', 'Dryer',
+             'Luggage dropoff allowed', 'Pool', 'Gym', 'Patio or balcony', 'Pets allowed', 'Breakfast', 'Hot tub', 'Beachfront',
+             'Waterfront', 'Garden or backyard', 'BBQ grill', 'Free street parking', 'Paid parking off premises', 'Smoking allowed',
+             'Room-darkening shades', 'Lockbox', 'Host greets you', 'Building staff', 'Indoor fireplace', 'Crib', 'High chair',
+             'Wheelchair accessible', 'Doorman', 'Safety card', 'Ethernet connection', 'Pocket wifi', 'Bathtub', 'Step-free access',
+             '24-hour check-in', 'Suitable for events', 'Keypad', 'Smart lock', 'Private living room']
+WORDS = ['cozy', 'bright', 'spacious', 'quiet', 'central', 'modern', 'charming', 'studio', 'apartment', 'room', 'house', 'view', 'sea',
+         'beach', 'city', 'centre', 'downtown', 'metro', 'station', 'garden', 'terrace', 'balcony', 'pool', 'family', 'friendly', 'near',
+         'walk', 'minutes', 'restaurants', 'shops', 'park', 'river', 'old', 'town', 'loft', 'private', 'large', 'comfortable', 'new',
+         'renovated', 'sunny', 'top', 'floor', 'elevator', 'kitchen', 'wifi', 'parking', 'airport', 'university', 'market']
+# share of listings without the field (or with an empty string), roughly what sample_airbnb has
+MISSING_SHARE = {'bedrooms': 0.001, 'beds': 0.002, 'security_deposit': 0.37, 'cleaning_fee': 0.27, 'review_scores_rating': 0.27,
+                 'house_rules': 0.05, 'empty_house_rules': 0.4, 'empty_description': 0.02, 'name': 0.0005}
+SCRAPED_FROM = datetime(2019, 2, 11)
+# documents generated at a time, bounds the memory of the generator at any row count
+SYNTHETIC_BATCH_SIZE = 10000
+MISSING = object()
+
+
+def zipf_weights(count, exponent=1.3):
+
+    weights = 1 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def sentences(rng, count, low, high):
+
+    # random word sequences, enough text for search and memory measurements without storing a corpus
+    lengths = rng.integers(low, high + 1, count)
+    words = np.array(WORDS)[rng.integers(0, len(WORDS), lengths.sum())]
+    ends = np.cumsum(lengths)
+    return [' '.join(words[end - length:end]) for end, length in zip(ends, lengths)]
+
+
+@lru_cache(maxsize=None)
+def decimal(value, places=2):
+
+    # money values repeat a lot, Decimal128 is immutable and slow to build
+    return Decimal128(f"{value:.{places}f}")
+
+
+def synthetic_listing_documents(count, seed=0, start_id=10000000):
+
+    # listingsAndReviews documents with every field the extractor reads, the same nesting, Decimal128 money fields and
+    # optional fields left out (or empty) like in the real dataset; values are drawn column wise, documents built at the end
+    rng = np.random.default_rng(seed)
+    shares = np.array([share for _, _, _, share in COUNTRIES])
+    country = rng.choice(len(COUNTRIES), count, p=shares / shares.sum())
+    centres = np.array([centre for _, _, centre, _ in COUNTRIES])[country]
+    longitudes = centres[:, 0] + rng.normal(0, 0.08, count)
+    latitudes = centres[:, 1] + rng.normal(0, 0.06, count)
+
+    property_type = rng.choice(len(PROPERTY_TYPES), count, p=zipf_weights(len(PROPERTY_TYPES)))
+    room_type = rng.choice(len(ROOM_TYPES), count, p=[0.62, 0.36, 0.02])
+    bed_type = rng.choice(len(BED_TYPES), count, p=[0.96, 0.02, 0.01, 0.005, 0.005])
+    cancellation = rng.choice(len(CANCELLATION_POLICIES), count, p=[0.42, 0.3, 0.27, 0.006, 0.004])
+    accommodates = np.clip(rng.poisson(2.5, count) + 1, 1, 16)
+    bedrooms = np.clip(np.ceil(accommodates / 2.5 + rng.normal(0, 0.5, count)), 0, 10).astype(int)
+    beds = np.clip(bedrooms + rng.integers(0, 2, count), 0, 25)
+    minimum_nights = rng.choice([1, 2, 3, 4, 5, 7, 14, 30], count, p=[0.35, 0.25, 0.15, 0.05, 0.05, 0.08, 0.03, 0.04])
+    maximum_nights = rng.choice([30, 60, 90, 365, 1125], count, p=[0.15, 0.1, 0.1, 0.15, 0.5])
+    number_of_reviews = rng.negative_binomial(0.6, 0.025, count)
+    price = np.round(np.exp(rng.normal(4.6, 0.75, count)))
+    security_deposit = np.round(price * rng.uniform(0, 3, count), -1)
+    cleaning_fee = np.round(price * rng.uniform(0.1, 0.6, count))
+    extra_people = rng.choice([0, 0, 10, 15, 20, 25, 50], count)
+    guests_included = rng.integers(1, 4, count)
+    availability = rng.integers(0, 366, count)
+    ratings = np.clip(np.round(rng.normal(93, 7, count)), 20, 100).astype(int)
+    hosts = rng.integers(0, max(count // 3, 1), count)
+    amenity_counts = rng.integers(5, 40, count)
+    amenity_ends = np.cumsum(amenity_counts)
+    amenities = np.array(AMENITIES)[rng.choice(len(AMENITIES), amenity_ends[-1] if count else 0, p=zipf_weights(len(AMENITIES), 0.6))]
+    names = sentences(rng, count, 3, 8)
+    descriptions = sentences(rng, count, 20, 120)
+    house_rules = sentences(rng, count, 0, 30)
+    scraped = rng.integers(0, 24 * 30, count)
+    missing = {field: rng.random(count) < share for field, share in MISSING_SHARE.items()}
+
+    # plain python lists, indexing numpy arrays one element at a time is what makes document building slow
+    property_type, room_type, bed_type, cancellation = property_type.tolist(), room_type.tolist(), bed_type.tolist(), cancellation.tolist()
+    country, longitudes, latitudes = country.tolist(), longitudes.tolist(), latitudes.tolist()
+    accommodates, bedrooms, beds, number_of_reviews = accommodates.tolist(), bedrooms.tolist(), beds.tolist(), number_of_reviews.tolist()
+    minimum_nights, maximum_nights = minimum_nights.astype(str).tolist(), maximum_nights.astype(str).tolist()
+    price, security_deposit, cleaning_fee, extra_people = price.tolist(), security_deposit.tolist(), cleaning_fee.tolist(), extra_people.tolist()
+    guests_included, availability, ratings, hosts, scraped = guests_included.tolist(), availability.tolist(), ratings.tolist(), hosts.tolist(), scraped.tolist()
+    amenities, amenity_ends, amenity_counts = amenities.tolist(), amenity_ends.tolist(), amenity_counts.tolist()
+    missing = {field: flags.tolist() for field, flags in missing.items()}
+
+    for i in range(count):
+        listing_id = str(start_id + i)
+        document = {'_id': listing_id,
+                    'listing_url': f"https://www.airbnb.com/rooms/{listing_id}",
+                    'name': '' if missing['name'][i] else names[i],
+                    'description': '' if missing['empty_description'][i] else descriptions[i],
+                    'property_type': PROPERTY_TYPES[property_type[i]],
+                    'room_type': ROOM_TYPES[room_type[i]],
+                    'bed_type': BED_TYPES[bed_type[i]],
+                    'minimum_nights': minimum_nights[i],
+                    'maximum_nights': maximum_nights[i],
+                    'cancellation_policy': CANCELLATION_POLICIES[cancellation[i]],
+                    'last_scraped': SCRAPED_FROM + timedelta(hours=scraped[i]),
+                    'accommodates': accommodates[i],
+                    'number_of_reviews': number_of_reviews[i],
+                    'amenities': list(dict.fromkeys(amenities[amenity_ends[i] - amenity_counts[i]:amenity_ends[i]])),
+                    'price': decimal(price[i]),
+                    'extra_people': decimal(extra_people[i]),
+                    'guests_included': decimal(guests_included[i], 0),
+                    'host': {'host_id': str(hosts[i]), 'host_name': f"Host {hosts[i]}"},
+                    'address': {'street': f"{COUNTRIES[country[i]][0]}, Street {i % 997}",
+                                'country': COUNTRIES[country[i]][0],
+                                'country_code': COUNTRIES[country[i]][1],
+                                'location': {'type': 'Point',
+                                             'coordinates': [longitudes[i], latitudes[i]],
+                                             'is_location_exact': bool(i % 5)}},
+                    'availability': {'availability_30': availability[i] % 31, 'availability_365': availability[i]},
+                    'review_scores': {} if missing['review_scores_rating'][i] else {'review_scores_rating': ratings[i]},
+                    # fields the extractor never reads, they only add to the document size like in the real collection
+                    'images': {'picture_url': f"https://a0.muscache.com/im/pictures/{listing_id}.jpg"},
+                    'reviews': []}
+        if not missing['house_rules'][i]:
+            document['house_rules'] = '' if missing['empty_house_rules'][i] else house_rules[i]
+        if not missing['bedrooms'][i]:
+            document['bedrooms'] = bedrooms[i]
+        if not missing['beds'][i]:
+            document['beds'] = beds[i]
+        if not missing['security_deposit'][i]:
+            document['security_deposit'] = decimal(security_deposit[i])
+        if not missing['cleaning_fee'][i]:
+            document['cleaning_fee'] = decimal(cleaning_fee[i])
+        yield document
+
+
+def synthetic_listing_batches(count, seed=0, batch=SYNTHETIC_BATCH_SIZE):
+
+    # lists of at most batch documents, only one batch of generated values is held at a time
+    for start in range(0, count, batch):
+        yield list(synthetic_listing_documents(min(batch, count - start), seed + start, start_id=10000000 + start))
+
+
+def field_value(document, path):
+
+    for key in path.split('.'):
+        if not isinstance(document, dict) or key not in document:
+            return MISSING
+        document = document[key]
+    return document
+
+
+def project_listing_document(document):
+
+    # what airbnb_projection_stage makes the server return, so the extractor can be fed without a database;
+    # missing paths are left out like $project does, $arrayElemAt of a missing array gives null
+    projected = {}
+    for column, expression in AIRBNB_FIELDS.items():
+        if isinstance(expression, dict):
+            array_path, position = expression['$arrayElemAt']
+            array = field_value(document, array_path[1:])
+            projected[column] = array[position] if isinstance(array, list) and len(array) > position else None
+        else:
+            value = field_value(document, expression[1:])
+            if value is not MISSING:
+                projected[column] = value
+    return projected
+
+
+def load_synthetic_listings(collection, count, seed=0, batch=SYNTHETIC_BATCH_SIZE):
+
+    # replaces the collection content, documents are generated and inserted one batch at a time
+    collection.drop()
+    for documents in synthetic_listing_batches(count, seed, batch):
+        collection.insert_many(documents, ordered=False)
+    return collection.estimated_document_count()
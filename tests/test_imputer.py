@@ -0,0 +1,98 @@
+import os
+import sys
+from fractions import Fraction
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import numpy as np
+import pytest
+
+from airbnb_extraction import read_airbnb_columns, airbnb_columns_to_dataframe
+from airbnb_preprocessing import AirbnbImputer, IMPUTE_MEAN_COLUMNS, convert_airbnb_dtypes, exact_sum
+from synthetic_airbnb import synthetic_listing_documents, project_listing_document
+
+# listings split into this many chunks for the chunked, merged and removed fits
+CHUNKS = 7
+ROWS = 5000
+
+
+class ProjectedDocuments:
+
+    # stands in for the collection, aggregate returns the documents as the server would after airbnb_projection_stage
+    def __init__(self, documents):
+        self.documents = documents
+
+    def aggregate(self, pipeline, batchSize=None):
+        return iter(self.documents)
+
+
+@pytest.fixture(scope='module')
+def listings_df():
+
+    documents = [project_listing_document(document) for document in synthetic_listing_documents(ROWS, 0)]
+    return convert_airbnb_dtypes(airbnb_columns_to_dataframe(read_airbnb_columns(ProjectedDocuments(documents))))
+
+
+@pytest.fixture(scope='module')
+def chunks(listings_df):
+
+    shuffled = listings_df.iloc[np.random.default_rng(0).permutation(len(listings_df))]
+    return [shuffled.iloc[positions] for positions in np.array_split(np.arange(len(shuffled)), CHUNKS)]
+
+
+def test_exact_sum_matches_fraction_in_any_order():
+
+    # float64 values of very different magnitudes, whose float sum depends on the order; Fraction adds them exactly
+    rng = np.random.default_rng(0)
+    values = rng.choice([-1, 1], 20000) * 10.0 ** rng.uniform(-300, 300, 20000)
+    values[rng.random(len(values)) < 0.1] = np.nan
+    values = np.concatenate([values, [0.0, -0.0, 5e-324, -5e-324, 1e308, -1e308, 0.1, 0.2, 0.3]])
+    reference = sum((Fraction(value) for value in values[~np.isnan(values)]), Fraction(0))
+    assert exact_sum(values) == reference
+    assert exact_sum(rng.permutation(values)) == reference
+
+
+def test_exact_means_match_fraction(listings_df):
+
+    full = AirbnbImputer().fit(listings_df)
+    for column in IMPUTE_MEAN_COLUMNS:
+        values = listings_df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values[~np.isnan(values)]
+        assert full.sums[column] / full.counts[column] == sum((Fraction(value) for value in values), Fraction(0)) / len(values)
+
+
+def test_chunked_merge_equals_full_fit(listings_df, chunks):
+
+    merged = AirbnbImputer()
+    for chunk in chunks:
+        merged.merge(AirbnbImputer().fit(chunk))
+    full = AirbnbImputer().fit(listings_df)
+    assert merged.to_dict() == full.to_dict()
+    assert merged.transform(listings_df.copy()).equals(full.transform(listings_df.copy()))
+
+
+def test_remove_then_merge_back(listings_df, chunks):
+
+    # listings taken back out leave the statistics of the rest, and putting them back restores the full statistics
+    removed = AirbnbImputer().fit(listings_df).remove(chunks[0]).remove(chunks[-1])
+    rest = AirbnbImputer()
+    for chunk in chunks[1:-1]:
+        rest.partial_fit(chunk)
+    assert removed.to_dict() == rest.to_dict()
+
+    restored = AirbnbImputer.from_dict(removed.to_dict()).merge(AirbnbImputer().fit(chunks[0])).partial_fit(chunks[-1])
+    assert restored.to_dict() == AirbnbImputer().fit(listings_df).to_dict()
+
+
+def test_round_trips(listings_df, tmp_path):
+
+    full = AirbnbImputer().fit(listings_df)
+    assert AirbnbImputer.from_dict(full.to_dict()).to_dict() == full.to_dict()
+
+    path = str(tmp_path / 'imputer.json')
+    full.save(path)
+    loaded = AirbnbImputer.load(path)
+    assert loaded.to_dict() == full.to_dict()
+    assert loaded.fill_values() == full.fill_values()